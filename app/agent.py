@@ -1,16 +1,170 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
 import logging
-from typing import Any
+import random
+import re
+import time
+from typing import IO, Any
 
-from openai import AsyncOpenAI, BadRequestError
+import httpx
+import orjson
+from cachetools import TTLCache
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    BadRequestError,
+    InternalServerError,
+    RateLimitError,
+)
 
 from app.prompts import SYSTEM_PROMPT
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Точные совпадения (модель + весь input + temperature) -> output_text.
+_RESPONSE_CACHE: TTLCache[str, str] = TTLCache(maxsize=1024, ttl=1800)
+# Выше этой температуры ответы намеренно вариативны, кэш не используем.
+_CACHEABLE_MAX_TEMPERATURE = 0.3
+# Запросы с тем же ключом, которые уже в полёте: повторные вызовы ждут первый.
+_INFLIGHT: dict[str, asyncio.Future[str]] = {}
+
+# Временные ошибки: повторяем на той же модели с backoff + jitter.
+_RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+_MAX_ATTEMPTS_PER_MODEL = 5
+# Явные таймауты вместо дефолтных 600s SDK: зависший запрос не держит обработчик минутами.
+_REQUEST_TIMEOUT = httpx.Timeout(120.0, connect=10.0, read=120.0)
+_TRANSCRIBE_TIMEOUT_SEC = 60.0
+
+_PLANNING_PROMPT_TEMPLATE = (
+    "Верни строго JSON без markdown. Формат:\n"
+    "{{\"reply\": string, \"actions\": Action[]}}\n"
+    "Action поддерживает только:\n"
+    "1) {{\"type\":\"add_task\",\"title\":string,\"project\":string,\"priority\":\"High\"|\"Medium\"|\"Low\"}}\n"
+    "2) {{\"type\":\"add_project\",\"name\":string,\"status\":\"Main\"|\"Support\"|\"Experiment\"|\"Paused\"|\"Done\",\"kpi\":string}}\n"
+    "3) {{\"type\":\"update_task_status\",\"title\":string,\"status\":\"Todo\"|\"Doing\"|\"Done\"|\"Paused\"}}\n"
+    "4) {{\"type\":\"update_project_status\",\"name\":string,\"status\":\"Main\"|\"Support\"|\"Experiment\"|\"Paused\"|\"Done\"}}\n"
+    "Если изменений в Notion не нужно, actions=[]. "
+    "Если пользователь просит план (например на 7 дней), сформируй список конкретных действий и заполни actions несколькими задачами add_task. "
+    "ВАЖНО: не пиши в reply, что изменения уже внесены в Notion. До фактического применения это только предложенный план. "
+    "Разрешение на изменения в Notion: {permission}; если no, actions=[]"
+)
+# Промпты собираются один раз при импорте: строки байт-в-байт одинаковы между запросами.
+_PLANNING_PROMPTS: dict[bool, str] = {
+    True: _PLANNING_PROMPT_TEMPLATE.format(permission="yes"),
+    False: _PLANNING_PROMPT_TEMPLATE.format(permission="no"),
+}
+_SYSTEM_MESSAGES: tuple[dict[str, str], ...] = ({"role": "system", "content": SYSTEM_PROMPT},)
+_PLANNING_MESSAGES: dict[bool, tuple[dict[str, str], ...]] = {
+    flag: (*_SYSTEM_MESSAGES, {"role": "system", "content": prompt})
+    for flag, prompt in _PLANNING_PROMPTS.items()
+}
+_NOTION_CONTEXT_PREFIX = "Контекст из Notion:\n"
+_SNAPSHOT_MAX_CHARS = 6000
+_SNAPSHOT_TRUNCATED_MARKER = "\n…(truncated)…\n"
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+
+_FAILED_REPLY = "Не удалось сформировать ответ."
+_UNAVAILABLE_REPLY = "Сервис временно недоступен. Попробуй чуть позже."
+# Заглушки вместо ответа модели: их нельзя кэшировать как ответ.
+FALLBACK_REPLIES = frozenset({_FAILED_REPLY, _UNAVAILABLE_REPLY})
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class _Breaker:
+    """Общий на процесс circuit breaker для вызовов OpenAI: closed -> open -> half_open."""
+
+    def __init__(self, threshold: int = 5, window_sec: float = 30.0, open_sec: float = 60.0) -> None:
+        self.threshold = threshold
+        self.window_sec = window_sec
+        self.open_sec = open_sec
+        self.failures = 0
+        self.window_started_at = 0.0
+        self.opened_at: float | None = None
+        self.probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.open_sec:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def release_probe(self) -> None:
+        self.probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        if self.probe_in_flight:
+            self.probe_in_flight = False
+            self.opened_at = now
+            LOGGER.warning("OpenAI circuit breaker re-opened after failed probe")
+            return
+        if now - self.window_started_at > self.window_sec:
+            self.window_started_at = now
+            self.failures = 0
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.threshold:
+            self.opened_at = now
+            LOGGER.warning("OpenAI circuit breaker opened for %.0fs", self.open_sec)
+
+
+_BREAKER = _Breaker()
+
+# Один AsyncOpenAI (и его пул соединений) на api_key на весь процесс.
+_CLIENTS: dict[str, AsyncOpenAI] = {}
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    transport = httpx.AsyncHTTPTransport(
+        retries=0,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=_REQUEST_TIMEOUT)
+
+
+def _get_async_client(api_key: str) -> AsyncOpenAI:
+    client = _CLIENTS.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            timeout=_REQUEST_TIMEOUT,
+            http_client=_build_http_client(),
+        )
+        _CLIENTS[api_key] = client
+    return client
+
+
+async def close_clients() -> None:
+    while _CLIENTS:
+        _, client = _CLIENTS.popitem()
+        await client.close()
+
 
 def _normalize_model_name(model: str) -> str:
     value = (model or "").strip()
@@ -20,9 +174,16 @@ def _normalize_model_name(model: str) -> str:
 
 
 class CoAgent:
+    __slots__ = ("client", "model", "_candidate_models")
+
     def __init__(self, api_key: str, model: str) -> None:
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = _get_async_client(api_key)
         self.model = _normalize_model_name(model)
+        self._candidate_models: list[str] = []
+        for m in [self.model, "gpt-5", "gpt-4.1-mini"]:
+            normalized = _normalize_model_name(m)
+            if normalized not in self._candidate_models:
+                self._candidate_models.append(normalized)
 
     async def _responses_create_with_retries(
         self,
@@ -30,58 +191,129 @@ class CoAgent:
         input_messages: list[dict[str, str]],
         temperature: float,
     ):
-        candidate_models: list[str] = []
-        for m in [self.model, "gpt-5", "gpt-4.1-mini"]:
-            normalized = _normalize_model_name(m)
-            if normalized not in candidate_models:
-                candidate_models.append(normalized)
-
-        for model in candidate_models:
-            params: dict[str, Any] = {
-                "model": model,
-                "input": input_messages,
-            }
-            # Для GPT-5 семейства temperature может быть недоступен/ограничен.
-            if not model.startswith("gpt-5"):
-                params["temperature"] = temperature
+        if not _BREAKER.allow():
+            raise CircuitOpenError("OpenAI circuit breaker is open")
+        # После allow() флаг пробы стоит только у того вызова, который её получил.
+        is_probe = _BREAKER.probe_in_flight
+        # Breaker считает только сбои сервиса (429/5xx/таймауты/сеть): BadRequest из-за
+        # слишком большого запроса одного пользователя не должен закрывать доступ всем.
+        last_error_retryable = False
+        try:
+            for model in self._candidate_models:
+                params: dict[str, Any] = {
+                    "model": model,
+                    "input": input_messages,
+                }
+                # Для GPT-5 семейства temperature может быть недоступен/ограничен.
+                if not model.startswith("gpt-5"):
+                    params["temperature"] = temperature
+
+                for attempt in range(_MAX_ATTEMPTS_PER_MODEL):
+                    # Breaker мог открыться из-за других запросов — дальше не долбим API.
+                    if _BREAKER.state == "open" and not is_probe:
+                        raise CircuitOpenError("OpenAI circuit breaker is open")
+                    try:
+                        response = await self.client.responses.create(**params)
+                        _BREAKER.record_success()
+                        return response
+                    except BadRequestError as exc:
+                        last_error_retryable = False
+                        LOGGER.warning(
+                            "OpenAI bad request for model=%s: %s",
+                            model,
+                            getattr(exc, "message", str(exc)),
+                        )
+                        break
+                    except _RETRYABLE_ERRORS as exc:
+                        last_error_retryable = True
+                        if attempt + 1 >= _MAX_ATTEMPTS_PER_MODEL:
+                            LOGGER.warning("OpenAI retries exhausted for model=%s: %s", model, exc)
+                            break
+                        delay = random.uniform(2, 4) * (attempt + 1)
+                        LOGGER.warning(
+                            "OpenAI transient error for model=%s (attempt %s), retry in %.1fs: %s",
+                            model,
+                            attempt + 1,
+                            delay,
+                            exc,
+                        )
+                        await asyncio.sleep(delay)
+                    except Exception:
+                        last_error_retryable = False
+                        LOGGER.exception("OpenAI responses.create failed for model=%s", model)
+                        break
+
+            # Один провал на весь вызов, а не на каждую попытку: иначе один запрос открывает breaker.
+            if last_error_retryable:
+                _BREAKER.record_failure()
+            raise RuntimeError("No compatible OpenAI model available for responses.create")
+        finally:
+            # Отменённая проба не должна оставить breaker в half_open навсегда.
+            if is_probe:
+                _BREAKER.release_probe()
+
+    async def _cached_create(
+        self,
+        *,
+        input_messages: list[dict[str, str]],
+        temperature: float,
+    ) -> str:
+        # Одинаковые запросы в полёте склеиваются всегда; в TTL-кэш попадают только детерминированные.
+        cacheable = temperature <= _CACHEABLE_MAX_TEMPERATURE
+        key = _cache_key((self.model, input_messages, temperature))
+        if cacheable:
+            cached = _RESPONSE_CACHE.get(key)
+            if cached is not None:
+                return cached
 
+        while (inflight := _INFLIGHT.get(key)) is not None:
             try:
-                return await self.client.responses.create(**params)
-            except BadRequestError as exc:
-                LOGGER.warning(
-                    "OpenAI bad request for model=%s: %s",
-                    model,
-                    getattr(exc, "message", str(exc)),
-                )
-                continue
-            except Exception:
-                LOGGER.exception("OpenAI responses.create failed for model=%s", model)
-                continue
-
-        raise RuntimeError("No compatible OpenAI model available for responses.create")
-
-    async def reply(self, user_text: str, notion_snapshot: str) -> str:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled() or _current_task_cancelling():
+                    raise
+                # Отменили ведущий вызов (другой пользователь), а не нас: делаем запрос сами.
+
+        future: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+        _INFLIGHT[key] = future
         try:
             response = await self._responses_create_with_retries(
-                input_messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {
-                        "role": "system",
-                        "content": f"Контекст из Notion:\n{notion_snapshot}",
-                    },
-                    {"role": "user", "content": user_text},
-                ],
+                input_messages=input_messages,
+                temperature=temperature,
+            )
+            text = response.output_text or ""
+            if text and cacheable:
+                _RESPONSE_CACHE[key] = text
+            future.set_result(text)
+            return text
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Помечаем исключение как полученное, если ожидающих не было.
+            future.exception()
+            raise
+        finally:
+            _INFLIGHT.pop(key, None)
+
+    async def reply(self, user_text: str, notion_snapshot: str, memory_block: str = "") -> str:
+        try:
+            output_text = await self._cached_create(
+                input_messages=_build_input(_SYSTEM_MESSAGES, notion_snapshot, memory_block, user_text),
                 temperature=0.4,
             )
-            return (response.output_text or "Не удалось сформировать ответ.").strip()
+            return (output_text or _FAILED_REPLY).strip()
+        except CircuitOpenError:
+            return _UNAVAILABLE_REPLY
         except Exception:
             LOGGER.exception("Primary reply generation failed")
-            return "Не удалось сформировать ответ."
+            return _FAILED_REPLY
 
-    async def transcribe_voice(self, audio_bytes: bytes, filename: str = "voice.ogg") -> str:
-        transcript = await self.client.audio.transcriptions.create(
+    async def transcribe_voice(self, audio: bytes | IO[bytes], filename: str = "voice.ogg") -> str:
+        transcript = await self.client.with_options(timeout=_TRANSCRIBE_TIMEOUT_SEC).audio.transcriptions.create(
             model="gpt-4o-mini-transcribe",
-            file=(filename, audio_bytes),
+            file=(filename, audio),
         )
         text = getattr(transcript, "text", "") or ""
         return text.strip()
@@ -91,40 +323,29 @@ class CoAgent:
         user_text: str,
         notion_snapshot: str,
         allow_notion_actions: bool,
+        memory_block: str = "",
     ) -> dict[str, Any]:
-        planning_prompt = (
-            "Верни строго JSON без markdown. Формат:\n"
-            "{\"reply\": string, \"actions\": Action[]}\n"
-            "Action поддерживает только:\n"
-            "1) {\"type\":\"add_task\",\"title\":string,\"project\":string,\"priority\":\"High\"|\"Medium\"|\"Low\"}\n"
-            "2) {\"type\":\"add_project\",\"name\":string,\"status\":\"Main\"|\"Support\"|\"Experiment\"|\"Paused\"|\"Done\",\"kpi\":string}\n"
-            "3) {\"type\":\"update_task_status\",\"title\":string,\"status\":\"Todo\"|\"Doing\"|\"Done\"|\"Paused\"}\n"
-            "4) {\"type\":\"update_project_status\",\"name\":string,\"status\":\"Main\"|\"Support\"|\"Experiment\"|\"Paused\"|\"Done\"}\n"
-            "Если изменений в Notion не нужно, actions=[]. "
-            "Если пользователь просит план (например на 7 дней), сформируй список конкретных действий и заполни actions несколькими задачами add_task. "
-            "ВАЖНО: не пиши в reply, что изменения уже внесены в Notion. До фактического применения это только предложенный план. "
-            f"Разрешение на изменения в Notion: {'yes' if allow_notion_actions else 'no'}; если no, actions=[]"
-        )
-
         try:
-            response = await self._responses_create_with_retries(
-                input_messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "system", "content": planning_prompt},
-                    {"role": "system", "content": f"Контекст из Notion:\n{notion_snapshot}"},
-                    {"role": "user", "content": user_text},
-                ],
+            output_text = await self._cached_create(
+                input_messages=_build_input(
+                    _PLANNING_MESSAGES[allow_notion_actions],
+                    notion_snapshot,
+                    memory_block,
+                    user_text,
+                ),
                 temperature=0.2,
             )
-            raw = (response.output_text or "").strip()
+            raw = output_text.strip()
+        except CircuitOpenError:
+            return {"reply": _UNAVAILABLE_REPLY, "actions": []}
         except Exception:
             LOGGER.exception("Planning response generation failed")
-            return {"reply": await self.reply(user_text, notion_snapshot), "actions": []}
+            return {"reply": await self.reply(user_text, notion_snapshot, memory_block), "actions": []}
         parsed = _safe_json(raw)
         if not isinstance(parsed, dict):
-            return {"reply": await self.reply(user_text, notion_snapshot), "actions": []}
+            return {"reply": await self.reply(user_text, notion_snapshot, memory_block), "actions": []}
 
-        reply_text = str(parsed.get("reply", "")).strip() or "Не удалось сформировать ответ."
+        reply_text = str(parsed.get("reply", "")).strip() or _FAILED_REPLY
         actions = parsed.get("actions", [])
         if not isinstance(actions, list):
             actions = []
@@ -133,16 +354,61 @@ class CoAgent:
         return {"reply": reply_text, "actions": actions}
 
 
+def _build_input(
+    static_messages: tuple[dict[str, str], ...],
+    notion_snapshot: str,
+    memory_block: str,
+    user_text: str,
+) -> list[dict[str, str]]:
+    # Порядок важен для prompt caching у OpenAI: сначала неизменные сообщения
+    # (SYSTEM_PROMPT, planning prompt), затем меняющийся контекст Notion и текст пользователя.
+    # Любое отличие в префиксе сбрасывает кэш для всего, что идёт после него.
+    # Поэтому system-сообщения только статичные (без дат и снапшотов), а контекст
+    # Notion и память идут отдельным user-сообщением после них.
+    # Обрезается только срез Notion: память добавляется после него целиком.
+    context = _NOTION_CONTEXT_PREFIX + _clip_snapshot(notion_snapshot)
+    if memory_block:
+        context += f"\n\n{memory_block}"
+    return [
+        *static_messages,
+        {"role": "user", "content": context},
+        {"role": "user", "content": user_text},
+    ]
+
+
+def _clip_snapshot(snapshot: str, max_chars: int = _SNAPSHOT_MAX_CHARS) -> str:
+    if len(snapshot) <= max_chars:
+        return snapshot
+    # Начало — активные проекты и задачи, конец — внешние источники Notion; режем середину.
+    budget = max_chars - len(_SNAPSHOT_TRUNCATED_MARKER)
+    head = budget * 2 // 3
+    tail = budget - head
+    LOGGER.info("Notion snapshot clipped: %s -> %s chars", len(snapshot), max_chars)
+    return snapshot[:head] + _SNAPSHOT_TRUNCATED_MARKER + snapshot[-tail:]
+
+
+def _current_task_cancelling() -> bool:
+    task = asyncio.current_task()
+    return task is not None and task.cancelling() > 0
+
+
+def _cache_key(material: tuple[Any, ...]) -> str:
+    payload = json.dumps(material, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 def _safe_json(raw: str) -> dict[str, Any] | None:
     try:
-        return json.loads(raw)
-    except Exception:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
         pass
 
-    if "```" in raw:
-        cleaned = raw.replace("```json", "").replace("```", "").strip()
-        try:
-            return json.loads(cleaned)
-        except Exception:
-            return None
-    return None
+    # Без markdown-ограждения чистить нечего. Проверяем именно "```", а не первый символ:
+    # модель может вернуть JSON с одним лишь закрывающим ограждением в конце.
+    if "```" not in raw:
+        return None
+    cleaned = _FENCE_RE.sub("", raw).strip()
+    try:
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
+        return None
@@ -1,26 +1,59 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import io
 import logging
+from collections import OrderedDict
 from datetime import datetime, time
-from typing import Any, Final
+from typing import Any, Callable, Coroutine, Final
 from zoneinfo import ZoneInfo
 
-from telegram import Update
+from telegram import Message, Update
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 
-from app.agent import CoAgent
+from app.agent import FALLBACK_REPLIES, CoAgent, close_clients
 from app.config import Settings
 from app.memory_store import MemoryStore
 from app.notion_service import NotionService
+from app.telegram_text import split_message
 
 LOGGER: Final = logging.getLogger(__name__)
+# Верхняя граница списка разблокированных пользователей: самые давние вытесняются.
+NOTION_UNLOCKED_USERS_MAX: Final = 10_000
 
 
 class TelegramCooBot:
+    __slots__ = (
+        "settings",
+        "notion_unlocked_users",
+        "pending_actions",
+        "notion",
+        "agent",
+        "memory",
+        "_background_tasks",
+    )
+
+    _ACTION_FORMATTERS: Final[dict[str, Callable[[dict[str, Any], int], str]]] = {
+        "add_task": lambda a, i: (
+            f"{i}. add_task: {a.get('title', '')} | project={a.get('project', 'General')} | priority={a.get('priority', 'Medium')}"
+        ),
+        "add_project": lambda a, i: (
+            f"{i}. add_project: {a.get('name', '')} | status={a.get('status', 'Experiment')}"
+        ),
+        "update_task_status": lambda a, i: (
+            f"{i}. update_task_status: {a.get('title', '')} -> {a.get('status', 'Todo')}"
+        ),
+        "update_project_status": lambda a, i: (
+            f"{i}. update_project_status: {a.get('name', '')} -> {a.get('status', 'Paused')}"
+        ),
+    }
+
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
-        self.notion_unlocked_users: set[int] = set()
+        self.notion_unlocked_users: OrderedDict[int, None] = OrderedDict()
         self.pending_actions: dict[int, dict[str, Any]] = {}
+        self._background_tasks: set[asyncio.Task[Any]] = set()
         self.notion = NotionService(
             token=settings.notion_token,
             parent_page_id=settings.notion_parent_page_id,
@@ -28,12 +61,20 @@ class TelegramCooBot:
             workspace_page_id=settings.notion_workspace_page_id,
             tasks_db_id=settings.notion_tasks_db_id,
             projects_db_id=settings.notion_projects_db_id,
+            snapshot_ttl_sec=settings.notion_snapshot_ttl_sec,
+            state_path=settings.notion_ids_cache_path,
         )
         self.agent = CoAgent(api_key=settings.openai_api_key, model=settings.openai_model)
         self.memory = MemoryStore(settings)
 
     def build_app(self) -> Application:
-        app = Application.builder().token(self.settings.telegram_bot_token).post_init(self._on_startup).build()
+        app = (
+            Application.builder()
+            .token(self.settings.telegram_bot_token)
+            .post_init(self._on_startup)
+            .post_shutdown(self._on_shutdown)
+            .build()
+        )
 
         app.add_handler(CommandHandler("start", self.start))
         app.add_handler(CommandHandler("help", self.help))
@@ -60,6 +101,27 @@ class TelegramCooBot:
             await self.memory.connect()
         except Exception:
             LOGGER.exception("Memory store init failed")
+        if self.notion.cached_ids:
+            self.notion.prefetch_snapshot()
+
+    async def _on_shutdown(self, app: Application) -> None:
+        del app
+        # Фоновые записи в память и ответы должны завершиться до закрытия хранилищ и клиентов.
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        try:
+            await self.memory.close()
+        except Exception:
+            LOGGER.exception("Memory store shutdown failed")
+        try:
+            await close_clients()
+        except Exception:
+            LOGGER.exception("OpenAI client shutdown failed")
+        try:
+            await self.notion.close()
+            await NotionService.aclose_all()
+        except Exception:
+            LOGGER.exception("Notion client shutdown failed")
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not await self._guard_user(update):
@@ -183,13 +245,13 @@ class TelegramCooBot:
             return
         user_id = update.effective_user.id if update.effective_user else 0
         if not self.settings.notion_access_phrase:
-            self.notion_unlocked_users.add(user_id)
+            self._unlock_notion(user_id)
             await update.message.reply_text("Доступ к Notion открыт (фраза не задана в env).")
             return
 
         phrase = " ".join(context.args).strip()
         if phrase and phrase == self.settings.notion_access_phrase:
-            self.notion_unlocked_users.add(user_id)
+            self._unlock_notion(user_id)
             await update.message.reply_text("Доступ к Notion открыт.")
             return
         await update.message.reply_text("Неверная фраза.")
@@ -266,17 +328,27 @@ class TelegramCooBot:
         if update.effective_user:
             LOGGER.info("Voice from user_id=%s username=%s", update.effective_user.id, update.effective_user.username)
 
-        await update.message.reply_text("Принял голосовое. Распознаю...")
-        voice = update.message.voice
-        file = await context.bot.get_file(voice.file_id)
-        audio_bytes = bytes(await file.download_as_bytearray())
-        transcript = await self.agent.transcribe_voice(audio_bytes, filename="voice.ogg")
+        # Снапшот Notion не зависит от текста, грузим его параллельно с распознаванием.
+        snapshot_task = asyncio.create_task(self._build_notion_snapshot(self._notion_allowed(update)))
+        try:
+            await update.message.reply_text("Принял голосовое. Распознаю...")
+            voice = update.message.voice
+            file = await context.bot.get_file(voice.file_id)
+            audio = io.BytesIO()
+            await file.download_to_memory(audio)
+            audio.seek(0)
+            transcript = await self.agent.transcribe_voice(audio, filename="voice.ogg")
+        except BaseException:
+            snapshot_task.cancel()
+            raise
         if not transcript:
+            snapshot_task.cancel()
             await update.message.reply_text("Не удалось распознать голосовое. Попробуй ещё раз.")
             return
 
         await update.message.reply_text(f"Распознал: {transcript[:800]}")
-        await self._process_user_input(update, transcript)
+        snapshot = await snapshot_task
+        await self._process_user_input(update, transcript, snapshot=snapshot)
 
     async def approve(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not await self._guard_user(update):
@@ -290,16 +362,18 @@ class TelegramCooBot:
             await update.message.reply_text("Нет предложенных изменений для применения.")
             return
 
+        actions = [a for a in pending.get("actions", []) if isinstance(a, dict)]
+        try:
+            results = await self.notion.execute_actions(actions)
+        except Exception as exc:
+            LOGGER.exception("Failed to prepare Notion workspace on approve")
+            results = [exc] * len(actions)
         action_logs: list[str] = []
-        for action in pending.get("actions", []):
-            if not isinstance(action, dict):
-                continue
-            try:
-                result = await self.notion.execute_action(action)
-                action_logs.append(result)
-            except Exception as exc:
-                LOGGER.exception("Failed Notion action on approve: %s", action)
-                action_logs.append(f"Ошибка изменения Notion: {exc}")
+        for action, result in zip(actions, results):
+            if isinstance(result, BaseException):
+                LOGGER.error("Failed Notion action on approve: %s", action, exc_info=result)
+                result = f"Ошибка изменения Notion: {result}"
+            action_logs.append(result)
 
         self.pending_actions.pop(user_id, None)
         if action_logs:
@@ -318,40 +392,41 @@ class TelegramCooBot:
         else:
             await update.message.reply_text("Нет активного плана для отклонения.")
 
-    async def _process_user_input(self, update: Update, user_text: str) -> None:
+    async def _process_user_input(
+        self,
+        update: Update,
+        user_text: str,
+        snapshot: str | None = None,
+    ) -> None:
         user_id = update.effective_user.id if update.effective_user else 0
-        notion_allowed = not self.settings.notion_access_phrase or (
-            update.effective_user and update.effective_user.id in self.notion_unlocked_users
-        )
+        notion_allowed = self._notion_allowed(update)
 
-        try:
-            if notion_allowed:
-                focus_snapshot = await self.notion.get_focus_snapshot()
-                external_snapshot = await self.notion.get_external_sources_snapshot()
-                snapshot = (
-                    f"{focus_snapshot}\n\nВнешние источники Notion:\n{external_snapshot}"
-                    if external_snapshot
-                    else focus_snapshot
-                )
-            else:
-                snapshot = "Notion недоступен: пользователь не прошёл /unlock."
-        except Exception as exc:
-            LOGGER.exception("Notion snapshot failed")
-            snapshot = f"Не удалось прочитать Notion: {exc}"
-
-        try:
-            mem = await self.memory.get_context(user_id=user_id, query=user_text)
-            mem_block = self.memory.format_context(mem)
-            if mem_block:
-                snapshot += f"\n\n{mem_block}"
-        except Exception:
-            LOGGER.exception("Memory retrieval failed")
+        if snapshot is None:
+            snapshot, mem_block = await asyncio.gather(
+                self._build_notion_snapshot(notion_allowed),
+                self._build_memory_block(user_id, user_text),
+            )
+        else:
+            mem_block = await self._build_memory_block(user_id, user_text)
+
+        # Кэш ответов привязан к состоянию Notion: после любых изменений в нём старые ответы не совпадут.
+        # История диалога в scope не входит — она меняется после каждого обмена, и повтор вопроса
+        # никогда бы не попал в кэш. Реплики, зависящие от диалога, отсекает минимальная длина.
+        cache_scope = hashlib.sha256(snapshot.encode("utf-8")).hexdigest()[:16]
+        cached_answer = await self._cached_reply(user_id, cache_scope, user_text)
+        if cached_answer:
+            await self._send_chunked(update.message, cached_answer)
+            self._fire_and_forget(
+                self._remember_exchange(user_id, user_text, cached_answer, f"Решение ассистента: {cached_answer[:1200]}")
+            )
+            return
 
         try:
             plan = await self.agent.reply_with_plan(
                 user_text=user_text,
                 notion_snapshot=snapshot,
                 allow_notion_actions=notion_allowed,
+                memory_block=mem_block,
             )
         except Exception as exc:
             LOGGER.exception("Agent reply failed")
@@ -361,11 +436,6 @@ class TelegramCooBot:
         answer = str(plan.get("reply", "")).strip() or "Не удалось сформировать ответ."
         actions = [a for a in plan.get("actions", []) if isinstance(a, dict)]
 
-        try:
-            await self.memory.remember_turn(user_id=user_id, role="user", content=user_text)
-        except Exception:
-            LOGGER.exception("Failed to store user turn in memory")
-
         if actions:
             self.pending_actions[user_id] = {"actions": actions, "reply": answer}
             actions_text = self._format_actions(actions)
@@ -376,378 +446,90 @@ class TelegramCooBot:
                 "⚠️ Изменения ещё НЕ применены.\n"
                 "Подтверди /approve или отмени /reject"
             )
-            await update.message.reply_text(msg[:4000])
-            try:
-                await self.memory.remember_turn(user_id=user_id, role="assistant", content=answer)
-                await self.memory.remember_fact(user_id=user_id, fact_text=f"План действий: {actions_text[:1200]}")
-            except Exception:
-                LOGGER.exception("Failed to store assistant plan in memory")
+            await self._send_chunked(update.message, msg)
+            self._fire_and_forget(
+                self._remember_exchange(user_id, user_text, answer, f"План действий: {actions_text[:1200]}")
+            )
             return
 
-        await update.message.reply_text(answer[:4000])
-        try:
-            await self.memory.remember_turn(user_id=user_id, role="assistant", content=answer)
-            await self.memory.remember_fact(user_id=user_id, fact_text=f"Решение ассистента: {answer[:1200]}")
-        except Exception:
-            LOGGER.exception("Failed to store assistant turn in memory")
-
-    async def on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-        del update
-        LOGGER.exception("Unhandled error: %s", context.error)
+        await self._send_chunked(update.message, answer)
+        self._fire_and_forget(
+            self._remember_exchange(user_id, user_text, answer, f"Решение ассистента: {answer[:1200]}")
+        )
+        if answer not in FALLBACK_REPLIES:
+            self._fire_and_forget(self._store_cached_reply(user_id, cache_scope, user_text, answer))
 
-    def _parse_hhmm(self, hhmm: str) -> time | None:
+    async def _cached_reply(self, user_id: int, scope: str, user_text: str) -> str | None:
         try:
-            hour_s, min_s = hhmm.split(":", 1)
-            hour, minute = int(hour_s), int(min_s)
-            if hour < 0 or hour > 23 or minute < 0 or minute > 59:
-                return None
-            return time(hour=hour, minute=minute, tzinfo=ZoneInfo(self.settings.bot_timezone))
+            return await self.memory.get_cached_reply(user_id=user_id, scope=scope, query=user_text)
         except Exception:
+            LOGGER.exception("Reply cache lookup failed")
             return None
 
-    async def _send_reminder(self, context: ContextTypes.DEFAULT_TYPE) -> None:
-        data = context.job.data or {}
-        text = str(data.get("text", "Пора проверить фокус и задачи"))
-        await context.bot.send_message(chat_id=context.job.chat_id, text=f"Напоминание COO: {text}")
-
-    def _job_name(self, user_id: int, reminder_id: str) -> str:
-        return f"reminder:{user_id}:{reminder_id}"
-
-    def _format_actions(self, actions: list[dict[str, Any]]) -> str:
-        lines: list[str] = []
-        for idx, action in enumerate(actions, start=1):
-            action_type = str(action.get("type", "unknown"))
-            if action_type == "add_task":
-                lines.append(
-                    f"{idx}. add_task: {action.get('title', '')} | project={action.get('project', 'General')} | priority={action.get('priority', 'Medium')}"
-                )
-            elif action_type == "add_project":
-                lines.append(
-                    f"{idx}. add_project: {action.get('name', '')} | status={action.get('status', 'Experiment')}"
-                )
-            elif action_type == "update_task_status":
-                lines.append(
-                    f"{idx}. update_task_status: {action.get('title', '')} -> {action.get('status', 'Todo')}"
-                )
-            elif action_type == "update_project_status":
-                lines.append(
-                    f"{idx}. update_project_status: {action.get('name', '')} -> {action.get('status', 'Paused')}"
-                )
-            else:
-                lines.append(f"{idx}. unknown_action: {action}")
-        return "\n".join(lines)
-
-    async def _guard_user(self, update: Update) -> bool:
-        user_id = update.effective_user.id if update.effective_user else None
-        username = (update.effective_user.username or "").lower() if update.effective_user else ""
-
-        checks: list[bool] = []
-        if self.settings.telegram_allowed_user_id is not None:
-            checks.append(user_id == self.settings.telegram_allowed_user_id)
-        if self.settings.telegram_allowed_username is not None:
-            checks.append(username == self.settings.telegram_allowed_username)
-
-        if checks and not any(checks):
-            LOGGER.warning("Blocked user_id=%s username=%s", user_id, username)
-            if update.message:
-                await update.message.reply_text("Доступ запрещён.")
-            return False
-        return True
-
-    async def _guard_notion_access(self, update: Update) -> bool:
-        if not self.settings.notion_access_phrase:
-            return True
-        user_id = update.effective_user.id if update.effective_user else None
-        if user_id in self.notion_unlocked_users:
-            return True
-        if update.message:
-            await update.message.reply_text("Сначала /unlock <секретная фраза>.")
-        return False
-        """
-            await update.message.reply_text("Использование: /remind HH:MM текст")
-            return
-
-        hhmm = args[0].strip()
-        reminder_text = " ".join(args[1:]).strip()
-        parsed_time = self._parse_hhmm(hhmm)
-        if not parsed_time:
-            await update.message.reply_text("Неверный формат времени. Нужен HH:MM")
-            return
-        if not reminder_text:
-            await update.message.reply_text("Добавь текст напоминания.")
-            return
-
-        chat_id = context.user_data.get("bound_chat_id", update.effective_chat.id)
-        reminder_id = f"r{int(datetime.now().timestamp())}"
-        payload = {"id": reminder_id, "text": reminder_text, "time": hhmm}
-
-                await self.memory.remember_turn(user_id=user_id, role="user", content=user_text)
-            self._send_reminder,
-            time=parsed_time,
-            chat_id=chat_id,
-            user_id=update.effective_user.id,
-            data=payload,
-            name=self._job_name(update.effective_user.id, reminder_id),
-        )
-
-        saved = context.user_data.get("reminders", [])
-        saved.append(payload)
-        context.user_data["reminders"] = saved
-
-        await update.message.reply_text(
-            f"Напоминание создано: id={reminder_id}, ежедневно в {hhmm} ({self.settings.bot_timezone})"
-                await self.memory.remember_turn(user_id=user_id, role="assistant", content=answer)
-                await self.memory.remember_fact(
-                    user_id=user_id,
-                    fact_text=f"План действий: {actions_text[:1200]}",
-                )
+    async def _store_cached_reply(self, user_id: int, scope: str, user_text: str, answer: str) -> None:
+        try:
+            await self.memory.cache_reply(user_id=user_id, scope=scope, query=user_text, answer=answer)
+        except Exception:
+            LOGGER.exception("Failed to store reply in cache")
 
-    async def reminders(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
+    async def _remember_exchange(self, user_id: int, user_text: str, answer: str, fact_text: str) -> None:
+        # Память не на критическом пути ответа: пишем в фоне, но в одном таске,
+        # чтобы реплики пользователя и ассистента не поменялись местами.
+        try:
+            await self.memory.remember_turn(user_id=user_id, role="user", content=user_text)
             await self.memory.remember_turn(user_id=user_id, role="assistant", content=answer)
-            await self.memory.remember_fact(
-                user_id=user_id,
-                fact_text=f"Решение ассистента: {answer[:1200]}",
-            )
-        if not items:
-            await update.message.reply_text("Активных напоминаний нет.")
-            return
-        text = "\n".join(f"- {r['id']}: {r['time']} | {r['text']}" for r in items[:20])
-        await update.message.reply_text("Твои напоминания:\n" + text)
-
-    async def unremind(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not update.effective_user:
-            return
-        if not context.args:
-            await update.message.reply_text("Использование: /unremind <id>")
-            return
-
-        reminder_id = context.args[0].strip()
-        job_name = self._job_name(update.effective_user.id, reminder_id)
-        jobs = context.job_queue.get_jobs_by_name(job_name)
-        for job in jobs:
-            job.schedule_removal()
-
-        items = context.user_data.get("reminders", [])
-        context.user_data["reminders"] = [r for r in items if r.get("id") != reminder_id]
-        await update.message.reply_text(f"Напоминание удалено: {reminder_id}")
-
-    async def unlock(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        user_id = update.effective_user.id if update.effective_user else 0
-
-        if not self.settings.notion_access_phrase:
-            self.notion_unlocked_users.add(user_id)
-            await update.message.reply_text("Доступ к Notion открыт (фраза не задана в env).")
-            return
+            await self.memory.remember_fact(user_id=user_id, fact_text=fact_text)
+        except Exception:
+            LOGGER.exception("Failed to store dialog turn in memory")
 
-        phrase = " ".join(context.args).strip()
-        if phrase and phrase == self.settings.notion_access_phrase:
-            self.notion_unlocked_users.add(user_id)
-            await update.message.reply_text("Доступ к Notion открыт.")
-            return
-        await update.message.reply_text("Неверная фраза.")
+    @staticmethod
+    async def _send_chunked(message: Message, text: str) -> None:
+        # Части отправляются последовательно: так Telegram сохраняет их порядок в чате.
+        for chunk in split_message(text):
+            await message.reply_text(chunk)
 
-    async def setup(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not await self._guard_notion_access(update):
-            return
-        ids = await self.notion.ensure_workspace()
-        await update.message.reply_text(
-            "Готово. Workspace в Notion подготовлен.\n"
-            f"WORKSPACE_PAGE_ID={ids.workspace_page_id}\n"
-            f"TASKS_DB_ID={ids.tasks_db_id}\n"
-            f"PROJECTS_DB_ID={ids.projects_db_id}\n"
-            f"MEMORY_DB_ID={ids.memory_db_id}"
+    def _notion_allowed(self, update: Update) -> bool:
+        return not self.settings.notion_access_phrase or bool(
+            update.effective_user and self._is_notion_unlocked(update.effective_user.id)
         )
 
-    async def focus(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not await self._guard_notion_access(update):
-            return
-        snapshot = await self.notion.get_focus_snapshot()
-        await update.message.reply_text(snapshot)
-
-    async def new_task(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not await self._guard_notion_access(update):
-            return
-        text = " ".join(context.args).strip()
-        if not text:
-            await update.message.reply_text("Использование: /newtask <текст задачи>")
-            return
-        task_id = await self.notion.add_task(text=text)
-        await update.message.reply_text(f"Задача добавлена в Notion. ID: {task_id}")
+    def _unlock_notion(self, user_id: int) -> None:
+        self.notion_unlocked_users[user_id] = None
+        self.notion_unlocked_users.move_to_end(user_id)
+        if len(self.notion_unlocked_users) > NOTION_UNLOCKED_USERS_MAX:
+            self.notion_unlocked_users.popitem(last=False)
 
-    async def new_project(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not await self._guard_notion_access(update):
-            return
-        name = " ".join(context.args).strip()
-        if not name:
-            await update.message.reply_text("Использование: /newproject <название проекта>")
-            return
-        project_id = await self.notion.add_project(name=name)
-        await update.message.reply_text(f"Проект добавлен в Notion. ID: {project_id}")
-
-    async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if update.effective_user:
-            LOGGER.info("Text from user_id=%s username=%s", update.effective_user.id, update.effective_user.username)
-
-        text = (update.message.text or "").strip()
-
-        if text.lower().startswith("задача:"):
-            if not await self._guard_notion_access(update):
-                return
-            task_text = text.split(":", 1)[1].strip()
-            if task_text:
-                task_id = await self.notion.add_task(task_text)
-                await update.message.reply_text(f"Сохранил задачу в Notion. ID: {task_id}")
-                return
-
-        await self._process_user_input(update, text)
-
-    async def handle_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not update.message or not update.message.voice:
-            return
-        if update.effective_user:
-            LOGGER.info("Voice from user_id=%s username=%s", update.effective_user.id, update.effective_user.username)
-
-        await update.message.reply_text("Принял голосовое. Распознаю...")
-        voice = update.message.voice
-        file = await context.bot.get_file(voice.file_id)
-        audio_bytes = bytes(await file.download_as_bytearray())
-        transcript = await self.agent.transcribe_voice(audio_bytes, filename="voice.ogg")
-        if not transcript:
-            await update.message.reply_text("Не удалось распознать голосовое. Попробуй ещё раз.")
-            return
-
-        await update.message.reply_text(f"Распознал: {transcript[:800]}")
-        await self._process_user_input(update, transcript)
-
-    async def approve(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        if not await self._guard_notion_access(update):
-            return
-
-        user_id = update.effective_user.id if update.effective_user else 0
-        pending = self.pending_actions.get(user_id)
-        if not pending:
-            await update.message.reply_text("Нет предложенных изменений для применения.")
-            return
-
-        action_logs: list[str] = []
-        for action in pending.get("actions", []):
-            if not isinstance(action, dict):
-                continue
-            try:
-                result = await self.notion.execute_action(action)
-                action_logs.append(result)
-            except Exception as exc:
-                LOGGER.exception("Failed Notion action on approve: %s", action)
-                action_logs.append(f"Ошибка изменения Notion: {exc}")
-
-        self.pending_actions.pop(user_id, None)
-        if action_logs:
-            await update.message.reply_text(
-                "Применил изменения в Notion:\n" + "\n".join(f"- {x}" for x in action_logs[:12])
-            )
-        else:
-            await update.message.reply_text("Изменений не применено.")
-
-    async def reject(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not await self._guard_user(update):
-            return
-        user_id = update.effective_user.id if update.effective_user else 0
-        had_plan = user_id in self.pending_actions
-        self.pending_actions.pop(user_id, None)
-        if had_plan:
-            await update.message.reply_text("Ок, изменения в Notion отклонены.")
-        else:
-            await update.message.reply_text("Нет активного плана для отклонения.")
-
-    async def _process_user_input(self, update: Update, user_text: str) -> None:
-        user_id = update.effective_user.id if update.effective_user else 0
-        notion_allowed = not self.settings.notion_access_phrase or (
-            update.effective_user and update.effective_user.id in self.notion_unlocked_users
-        )
+    def _is_notion_unlocked(self, user_id: int | None) -> bool:
+        if user_id not in self.notion_unlocked_users:
+            return False
+        self.notion_unlocked_users.move_to_end(user_id)
+        return True
 
+    async def _build_notion_snapshot(self, notion_allowed: bool) -> str:
+        if not notion_allowed:
+            return "Notion недоступен: пользователь не прошёл /unlock."
         try:
-            if notion_allowed:
-                focus_snapshot = await self.notion.get_focus_snapshot()
-                external_snapshot = await self.notion.get_external_sources_snapshot()
-                if external_snapshot:
-                    snapshot = f"{focus_snapshot}\n\nВнешние источники Notion:\n{external_snapshot}"
-                else:
-                    snapshot = focus_snapshot
-
-                memory_context = await self.notion.get_memory_context(user_id=user_id, limit=12)
-                if memory_context:
-                    snapshot += f"\n\nИстория диалога (кратко):\n{memory_context}"
-            else:
-                snapshot = "Notion недоступен: пользователь не прошёл /unlock."
+            focus_snapshot, external_snapshot = await asyncio.gather(
+                self.notion.get_focus_snapshot(),
+                self.notion.get_external_sources_snapshot(),
+            )
         except Exception as exc:
             LOGGER.exception("Notion snapshot failed")
-            snapshot = f"Не удалось прочитать Notion: {exc}"
+            return f"Не удалось прочитать Notion: {exc}"
+        if external_snapshot:
+            return f"{focus_snapshot}\n\nВнешние источники Notion:\n{external_snapshot}"
+        return focus_snapshot
 
+    async def _build_memory_block(self, user_id: int, user_text: str) -> str:
         try:
-            plan = await self.agent.reply_with_plan(
-                user_text=user_text,
-                notion_snapshot=snapshot,
-                allow_notion_actions=notion_allowed,
-            )
-        except Exception as exc:
-            LOGGER.exception("Agent reply failed")
-            await update.message.reply_text(f"Ошибка ответа модели: {exc}")
-            return
-
-        answer = str(plan.get("reply", "")).strip() or "Не удалось сформировать ответ."
-        actions = [a for a in plan.get("actions", []) if isinstance(a, dict)]
-
-        if notion_allowed:
-            try:
-                await self.notion.add_memory_entry(user_id=user_id, role="user", text=user_text)
-            except Exception:
-                LOGGER.exception("Failed to store user memory entry")
-
-        if actions:
-            self.pending_actions[user_id] = {"actions": actions, "reply": answer}
-            actions_text = self._format_actions(actions)
-            msg = (
-                f"{answer}\n\n"
-                "План изменений в Notion (ожидает подтверждения):\n"
-                f"{actions_text}\n\n"
-                "Подтверди /approve или отмени /reject"
-            )
-            await update.message.reply_text(msg[:4000])
-            if notion_allowed:
-                try:
-                    await self.notion.add_memory_entry(user_id=user_id, role="assistant", text=answer)
-                except Exception:
-                    LOGGER.exception("Failed to store assistant memory entry")
-            return
-
-        await update.message.reply_text(answer[:4000])
-        if notion_allowed:
-            try:
-                await self.notion.add_memory_entry(user_id=user_id, role="assistant", text=answer)
-            except Exception:
-                LOGGER.exception("Failed to store assistant memory entry")
+            mem = await self.memory.get_context(user_id=user_id, query=user_text)
+            return self.memory.format_context(mem)
+        except Exception:
+            LOGGER.exception("Memory retrieval failed")
+            return ""
 
     async def on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        del update
         LOGGER.exception("Unhandled error: %s", context.error)
 
     def _parse_hhmm(self, hhmm: str) -> time | None:
@@ -771,41 +553,28 @@ class TelegramCooBot:
     def _format_actions(self, actions: list[dict[str, Any]]) -> str:
         lines: list[str] = []
         for idx, action in enumerate(actions, start=1):
-            action_type = str(action.get("type", "unknown"))
-            if action_type == "add_task":
-                lines.append(
-                    f"{idx}. add_task: {action.get('title', '')} | project={action.get('project', 'General')} | priority={action.get('priority', 'Medium')}"
-                )
-            elif action_type == "add_project":
-                lines.append(
-                    f"{idx}. add_project: {action.get('name', '')} | status={action.get('status', 'Experiment')}"
-                )
-            elif action_type == "update_task_status":
-                lines.append(
-                    f"{idx}. update_task_status: {action.get('title', '')} -> {action.get('status', 'Todo')}"
-                )
-            elif action_type == "update_project_status":
-                lines.append(
-                    f"{idx}. update_project_status: {action.get('name', '')} -> {action.get('status', 'Paused')}"
-                )
-            else:
-                lines.append(f"{idx}. unknown_action: {action}")
+            fmt = self._ACTION_FORMATTERS.get(str(action.get("type", "unknown")), self._fmt_unknown)
+            lines.append(fmt(action, idx))
         return "\n".join(lines)
 
+    @staticmethod
+    def _fmt_unknown(action: dict[str, Any], idx: int) -> str:
+        return f"{idx}. unknown_action: {action}"
+
     async def _guard_user(self, update: Update) -> bool:
         user_id = update.effective_user.id if update.effective_user else None
         username = (update.effective_user.username or "").lower() if update.effective_user else ""
 
         checks: list[bool] = []
-        if self.settings.telegram_allowed_user_id is not None:
-            checks.append(user_id == self.settings.telegram_allowed_user_id)
+        if self.settings.telegram_allowed_user_ids:
+            checks.append(user_id in self.settings.telegram_allowed_user_ids)
         if self.settings.telegram_allowed_username is not None:
             checks.append(username == self.settings.telegram_allowed_username)
 
         if checks and not any(checks):
-            LOGGER.warning("Blocked user_id=%s", user_id)
+            LOGGER.warning("Blocked user_id=%s username=%s", user_id, username)
             if update.message:
-                await update.message.reply_text("Доступ запрещён.")
+                self._fire_and_forget(update.message.reply_text("Доступ запрещён."))
             return False
         return True
 
@@ -813,9 +582,18 @@ class TelegramCooBot:
         if not self.settings.notion_access_phrase:
             return True
         user_id = update.effective_user.id if update.effective_user else None
-        if user_id in self.notion_unlocked_users:
+        if self._is_notion_unlocked(user_id):
             return True
         if update.message:
-            await update.message.reply_text("Сначала /unlock <секретная фраза>.")
+            self._fire_and_forget(update.message.reply_text("Сначала /unlock <секретная фраза>."))
         return False
-        """
+
+    def _fire_and_forget(self, coro: Coroutine[Any, Any, Any]) -> None:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Task[Any]) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.error("Background task failed", exc_info=task.exception())
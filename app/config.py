@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass
+from typing import Any, Callable
 
 from dotenv import load_dotenv
 
@@ -9,7 +10,7 @@ from dotenv import load_dotenv
 @dataclass(frozen=True)
 class Settings:
     telegram_bot_token: str
-    telegram_allowed_user_id: int | None
+    telegram_allowed_user_ids: frozenset[int]
     telegram_allowed_username: str | None
     bot_timezone: str
     openai_api_key: str
@@ -27,50 +28,75 @@ class Settings:
     notion_workspace_page_id: str | None
     notion_tasks_db_id: str | None
     notion_projects_db_id: str | None
+    notion_snapshot_ttl_sec: float
+    notion_ids_cache_path: str
+
+
+def _str(raw: str) -> str:
+    return raw.strip()
+
+
+def _optional_str(raw: str) -> str | None:
+    return raw.strip() or None
+
+
+def _optional_id(raw: str) -> str | None:
+    return raw.replace("-", "").strip() or None
+
+
+def _int_set(raw: str) -> frozenset[int]:
+    return frozenset(int(x) for x in raw.split(",") if x.strip())
+
+
+def _username(raw: str) -> str | None:
+    return raw.strip().lstrip("@").lower() or None
+
+
+def _id_list(raw: str) -> list[str]:
+    return [x.replace("-", "").strip() for x in raw.split(",") if x.strip()]
+
+
+def _bool(raw: str) -> bool:
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+# (поле Settings, переменная окружения, значение по умолчанию, парсер, обязательна ли)
+_ENV_SPEC: tuple[tuple[str, str, str, Callable[[str], Any], bool], ...] = (
+    ("telegram_bot_token", "TELEGRAM_BOT_TOKEN", "", _str, True),
+    ("telegram_allowed_user_ids", "TELEGRAM_ALLOWED_USER_ID", "", _int_set, False),
+    ("telegram_allowed_username", "TELEGRAM_ALLOWED_USERNAME", "", _username, False),
+    ("bot_timezone", "BOT_TIMEZONE", "Europe/Moscow", _str, False),
+    ("openai_api_key", "OPENAI_API_KEY", "", _str, True),
+    ("openai_model", "OPENAI_MODEL", "gpt-5", _str, False),
+    ("memory_embed_model", "MEMORY_EMBED_MODEL", "text-embedding-3-small", _str, False),
+    ("database_url", "DATABASE_URL", "", _optional_str, False),
+    ("redis_url", "REDIS_URL", "", _optional_str, False),
+    ("memory_enabled", "MEMORY_ENABLED", "true", _bool, False),
+    ("memory_recent_turns", "MEMORY_RECENT_TURNS", "10", int, False),
+    ("memory_semantic_k", "MEMORY_SEMANTIC_K", "6", int, False),
+    ("notion_token", "NOTION_TOKEN", "", _str, True),
+    ("notion_parent_page_id", "NOTION_PARENT_PAGE_ID", "", _optional_id, False),
+    ("notion_source_db_ids", "NOTION_SOURCE_DB_IDS", "", _id_list, False),
+    ("notion_access_phrase", "NOTION_ACCESS_PHRASE", "", _optional_str, False),
+    ("notion_workspace_page_id", "NOTION_WORKSPACE_PAGE_ID", "", _optional_id, False),
+    ("notion_tasks_db_id", "NOTION_TASKS_DB_ID", "", _optional_id, False),
+    ("notion_projects_db_id", "NOTION_PROJECTS_DB_ID", "", _optional_id, False),
+    ("notion_snapshot_ttl_sec", "NOTION_SNAPSHOT_TTL_SEC", "45", float, False),
+    ("notion_ids_cache_path", "NOTION_IDS_CACHE_PATH", ".coo_state.json", _str, False),
+)
 
 
 def load_settings() -> Settings:
     load_dotenv()
 
-    telegram_bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
-    openai_api_key = os.getenv("OPENAI_API_KEY", "").strip()
-    notion_token = os.getenv("NOTION_TOKEN", "").strip()
-    notion_parent_page_id = os.getenv("NOTION_PARENT_PAGE_ID", "").replace("-", "").strip() or None
-
-    if not telegram_bot_token:
-        raise ValueError("TELEGRAM_BOT_TOKEN is required")
-    if not openai_api_key:
-        raise ValueError("OPENAI_API_KEY is required")
-    if not notion_token:
-        raise ValueError("NOTION_TOKEN is required")
-
-    allowed_user_raw = os.getenv("TELEGRAM_ALLOWED_USER_ID", "").strip()
-    allowed_user = int(allowed_user_raw) if allowed_user_raw else None
-    allowed_username = os.getenv("TELEGRAM_ALLOWED_USERNAME", "").strip().lstrip("@").lower() or None
-    source_db_ids_raw = os.getenv("NOTION_SOURCE_DB_IDS", "").strip()
-    source_db_ids = [x.replace("-", "").strip() for x in source_db_ids_raw.split(",") if x.strip()]
-
-    memory_enabled_raw = os.getenv("MEMORY_ENABLED", "true").strip().lower()
-    memory_enabled = memory_enabled_raw in {"1", "true", "yes", "on"}
-
-    return Settings(
-        telegram_bot_token=telegram_bot_token,
-        telegram_allowed_user_id=allowed_user,
-        telegram_allowed_username=allowed_username,
-        bot_timezone=os.getenv("BOT_TIMEZONE", "Europe/Moscow").strip(),
-        openai_api_key=openai_api_key,
-        openai_model=os.getenv("OPENAI_MODEL", "gpt-5").strip(),
-        memory_embed_model=os.getenv("MEMORY_EMBED_MODEL", "text-embedding-3-small").strip(),
-        database_url=(os.getenv("DATABASE_URL", "").strip() or None),
-        redis_url=(os.getenv("REDIS_URL", "").strip() or None),
-        memory_enabled=memory_enabled,
-        memory_recent_turns=int(os.getenv("MEMORY_RECENT_TURNS", "10").strip()),
-        memory_semantic_k=int(os.getenv("MEMORY_SEMANTIC_K", "6").strip()),
-        notion_token=notion_token,
-        notion_parent_page_id=notion_parent_page_id,
-        notion_source_db_ids=source_db_ids,
-        notion_access_phrase=(os.getenv("NOTION_ACCESS_PHRASE", "").strip() or None),
-        notion_workspace_page_id=(os.getenv("NOTION_WORKSPACE_PAGE_ID", "").replace("-", "").strip() or None),
-        notion_tasks_db_id=(os.getenv("NOTION_TASKS_DB_ID", "").replace("-", "").strip() or None),
-        notion_projects_db_id=(os.getenv("NOTION_PROJECTS_DB_ID", "").replace("-", "").strip() or None),
-    )
+    values: dict[str, Any] = {}
+    missing: list[str] = []
+    for field, env_name, default, parse, required in _ENV_SPEC:
+        value = parse(os.getenv(env_name, default))
+        if required and not value:
+            missing.append(env_name)
+        values[field] = value
+
+    if missing:
+        raise ValueError(f"Required environment variables are not set: {', '.join(missing)}")
+    return Settings(**values)
@@ -1,25 +1,149 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import contextlib
+import hashlib
 import logging
 from typing import Any
 
 import asyncpg
+import orjson
 import redis.asyncio as redis
+import zstandard
 from openai import AsyncOpenAI
+from pgvector.asyncpg import register_vector
 
 from app.config import Settings
 
 LOGGER = logging.getLogger(__name__)
 
+EMBED_BATCH_MAX = 16
+EMBED_BATCH_WAIT_SEC = 0.05
+TURN_BATCH_MAX = 50
+TURN_BATCH_WAIT_SEC = 0.1
+REPLY_CACHE_TTL_SEC = 60 * 60
+# Короткие реплики («да», «подробнее») зависят от диалога — их ответы не кэшируем.
+REPLY_CACHE_MIN_CHARS = 20
+
+# Горячие запросы держим модульными константами: asyncpg сам кэширует prepared statements
+# на каждом соединении по тексту запроса, так что парсинг и планирование идут один раз.
+_SQL_RECENT_TURNS = """
+SELECT role, content, content_z
+FROM memory_turns
+WHERE user_id = $1
+ORDER BY id DESC
+LIMIT $2
+"""
+_SQL_NEAREST_FACTS = """
+SELECT fact_text
+FROM memory_facts
+WHERE user_id = $1
+ORDER BY embedding <=> $2
+LIMIT $3
+"""
+_SQL_ANN_INDEXDEF = "SELECT indexdef FROM pg_indexes WHERE indexname = 'idx_memory_facts_embedding'"
+_SQL_CACHED_REPLY = """
+SELECT answer
+FROM reply_cache
+WHERE user_id = $1
+  AND scope = $2
+  AND query_hash = $3
+  AND created_at > NOW() - make_interval(secs => $4)
+ORDER BY id DESC
+LIMIT 1
+"""
+_SQL_PRUNE_REPLIES = "DELETE FROM reply_cache WHERE user_id = $1 AND created_at < NOW() - make_interval(secs => $2)"
+_SQL_INSERT_REPLY = "INSERT INTO reply_cache(user_id, scope, query_hash, answer) VALUES($1, $2, $3, $4)"
+
+
+class _EmbeddingBatcher:
+    """Собирает конкурентные запросы эмбеддингов в один embeddings.create(input=[...])."""
+
+    def __init__(self, openai: AsyncOpenAI, model: str) -> None:
+        self.openai = openai
+        self.model = model
+        self._queue: asyncio.Queue[tuple[str, asyncio.Future[list[float]]]] = asyncio.Queue()
+        self._worker: asyncio.Task[None] | None = None
+        self._flushes: set[asyncio.Task[None]] = set()
+        # Пачка, которую воркер собирает прямо сейчас: при close() её элементы ещё не отправлены.
+        self._collecting: list[tuple[str, asyncio.Future[list[float]]]] = []
+
+    async def embed(self, text: str) -> list[float]:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future: asyncio.Future[list[float]] = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+        # Отправленные пачки дожидаемся до закрытия клиента OpenAI, неотправленные — отклоняем.
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        pending, self._collecting = self._collecting, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        error = RuntimeError("Embedding batcher is closed")
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._collecting = [await self._queue.get()]
+            deadline = loop.time() + EMBED_BATCH_WAIT_SEC
+            while len(batch) < EMBED_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Отправка идёт отдельным таском, пока собирается следующая пачка.
+            self._collecting = []
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[str, asyncio.Future[list[float]]]]) -> None:
+        try:
+            response = await self.openai.embeddings.create(
+                model=self.model,
+                input=[text for text, _ in batch],
+            )
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        vectors = sorted(response.data, key=lambda item: item.index)
+        for (_, future), item in zip(batch, vectors):
+            if not future.done():
+                future.set_result(item.embedding)
+
 
 class MemoryStore:
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
         self.openai = AsyncOpenAI(api_key=settings.openai_api_key)
+        self.embedder = _EmbeddingBatcher(self.openai, settings.memory_embed_model)
+        self._embed_inflight: dict[str, asyncio.Future[list[float]]] = {}
+        self._turn_buf: list[tuple[int, str, bytes]] = []
+        self._turn_event = asyncio.Event()
+        self._turn_flusher: asyncio.Task[None] | None = None
+        self._turns_closing = False
+        self._zctx = zstandard.ZstdCompressor(level=3)
+        self._zdctx = zstandard.ZstdDecompressor()
         self.pg_pool: asyncpg.Pool | None = None
         self.redis: redis.Redis | None = None
         self.vector_enabled = False
+        self.ann_index: str | None = None
         self.initialized = False
 
     async def connect(self) -> None:
@@ -31,8 +155,20 @@ class MemoryStore:
             return
 
         if self.settings.database_url:
-            self.pg_pool = await asyncpg.create_pool(self.settings.database_url, min_size=1, max_size=5)
-            await self._init_schema()
+            # Схема (и extension vector) создаются до пула: init-хук пула регистрирует
+            # кодек vector, а для этого тип уже должен существовать в базе.
+            conn = await asyncpg.connect(self.settings.database_url)
+            try:
+                await self._init_schema(conn)
+            finally:
+                await conn.close()
+            self.pg_pool = await asyncpg.create_pool(
+                self.settings.database_url,
+                min_size=1,
+                max_size=5,
+                init=self._init_connection,
+                server_settings=self._ann_server_settings(),
+            )
 
         if self.settings.redis_url:
             self.redis = redis.from_url(self.settings.redis_url, decode_responses=True)
@@ -45,46 +181,130 @@ class MemoryStore:
             self.vector_enabled,
         )
 
-    async def _init_schema(self) -> None:
-        assert self.pg_pool is not None
-        async with self.pg_pool.acquire() as conn:
-            try:
-                await conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-                self.vector_enabled = True
-            except Exception:
-                self.vector_enabled = False
-                LOGGER.warning("pgvector extension not available; semantic memory disabled")
+    async def close(self) -> None:
+        await self.embedder.close()
+        if self._turn_flusher is not None:
+            # Флашер не отменяем: пачка внутри COPY уже вынута из буфера и при отмене пропала бы.
+            # Просим цикл завершиться и ждём, пока текущая запись дойдёт до конца.
+            self._turns_closing = True
+            self._turn_event.set()
+            await self._turn_flusher
+            self._turn_flusher = None
+            self._turns_closing = False
+        if self.redis:
+            await self.redis.aclose()
+            self.redis = None
+        if self.pg_pool:
+            await self._flush_turns()
+            await self.pg_pool.close()
+            self.pg_pool = None
+        await self.openai.close()
+        self.initialized = False
+
+    async def _init_connection(self, conn: asyncpg.Connection) -> None:
+        if not self.vector_enabled:
+            return
+        await register_vector(conn)
+
+    def _ann_server_settings(self) -> dict[str, str]:
+        # Поиск идёт с фильтром по user_id поверх ANN-индекса: берём кандидатов с запасом.
+        # Параметры задаются при подключении, а не через SET: пул делает RESET ALL при каждом возврате.
+        if self.ann_index == "hnsw":
+            return {"hnsw.ef_search": "100"}
+        if self.ann_index == "ivfflat":
+            return {"ivfflat.probes": "10"}
+        return {}
+
+    async def _init_schema(self, conn: asyncpg.Connection) -> None:
+        try:
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            self.vector_enabled = True
+        except Exception:
+            self.vector_enabled = False
+            LOGGER.warning("pgvector extension not available; semantic memory disabled")
+
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS memory_turns (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT,
+                content_z BYTEA,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        # Миграция старых таблиц: новые реплики пишутся в content_z (zstd), старые остаются в content.
+        await conn.execute(
+            """
+            ALTER TABLE memory_turns ADD COLUMN IF NOT EXISTS content_z BYTEA;
+            ALTER TABLE memory_turns ALTER COLUMN content DROP NOT NULL;
+            """
+        )
 
+        if self.vector_enabled:
             await conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS memory_turns (
+                CREATE TABLE IF NOT EXISTS memory_facts (
                     id BIGSERIAL PRIMARY KEY,
                     user_id BIGINT NOT NULL,
-                    role TEXT NOT NULL,
-                    content TEXT NOT NULL,
+                    fact_text TEXT NOT NULL,
+                    embedding vector(1536) NOT NULL,
                     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 );
                 """
             )
+            await conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_memory_facts_user_id
+                ON memory_facts(user_id);
+                """
+            )
+            await self._init_ann_index(conn)
 
-            if self.vector_enabled:
-                await conn.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS memory_facts (
-                        id BIGSERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL,
-                        fact_text TEXT NOT NULL,
-                        embedding vector(1536) NOT NULL,
-                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                    );
-                    """
-                )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reply_cache (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                scope TEXT NOT NULL,
+                query_hash TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_reply_cache_lookup
+            ON reply_cache(user_id, scope, query_hash, created_at);
+            """
+        )
+
+    async def _init_ann_index(self, conn: asyncpg.Connection) -> None:
+        try:
+            await conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_memory_facts_embedding
+                ON memory_facts USING hnsw (embedding vector_cosine_ops);
+                """
+            )
+        except asyncpg.PostgresError:
+            LOGGER.info("HNSW index unavailable (pgvector < 0.5?); falling back to ivfflat")
+            try:
                 await conn.execute(
                     """
-                    CREATE INDEX IF NOT EXISTS idx_memory_facts_user_id
-                    ON memory_facts(user_id);
+                    CREATE INDEX IF NOT EXISTS idx_memory_facts_embedding
+                    ON memory_facts USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
                     """
                 )
+            except asyncpg.PostgresError:
+                LOGGER.warning("ANN index on memory_facts.embedding not created; semantic search will scan")
+
+        # IF NOT EXISTS молча оставляет уже существующий индекс — его тип читаем из каталога.
+        indexdef = await conn.fetchval(_SQL_ANN_INDEXDEF)
+        self.ann_index = _ann_index_method(indexdef)
 
     async def remember_turn(self, user_id: int, role: str, content: str) -> None:
         if not self.settings.memory_enabled:
@@ -94,39 +314,74 @@ class MemoryStore:
 
         clipped = content.strip()[:2000]
 
+        # В Postgres реплики уходят пачками через COPY; Redis пишем сразу, он отдаёт свежую историю.
+        if self.pg_pool:
+            self._buffer_pg_turn(user_id, role, clipped)
         if self.redis:
-            key = f"mem:recent:{user_id}"
-            payload = json.dumps({"role": role, "content": clipped})
-            await self.redis.lpush(key, payload)
-            await self.redis.ltrim(key, 0, max(self.settings.memory_recent_turns - 1, 0))
-            await self.redis.expire(key, 60 * 60 * 72)
+            try:
+                await self._redis_push_turn(user_id, role, clipped)
+            except Exception as exc:
+                LOGGER.warning("Memory turn write to Redis failed: %s", exc)
 
-        if self.pg_pool:
+    async def _redis_push_turn(self, user_id: int, role: str, content: str) -> None:
+        assert self.redis is not None
+        key = f"mem:recent:{user_id}"
+        payload = orjson.dumps({"role": role, "content": content}).decode()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lpush(key, payload)
+            pipe.ltrim(key, 0, max(self.settings.memory_recent_turns - 1, 0))
+            pipe.expire(key, 60 * 60 * 72)
+            await pipe.execute()
+
+    def _buffer_pg_turn(self, user_id: int, role: str, content: str) -> None:
+        self._turn_buf.append((user_id, role, self._zctx.compress(content.encode("utf-8"))))
+        if self._turn_flusher is None or self._turn_flusher.done():
+            self._turn_flusher = asyncio.create_task(self._flush_turns_loop())
+        self._turn_event.set()
+
+    async def _flush_turns_loop(self) -> None:
+        while not self._turns_closing:
+            await self._turn_event.wait()
+            if len(self._turn_buf) < TURN_BATCH_MAX and not self._turns_closing:
+                await asyncio.sleep(TURN_BATCH_WAIT_SEC)
+            self._turn_event.clear()
+            await self._flush_turns()
+
+    async def _flush_turns(self) -> None:
+        if not self._turn_buf or not self.pg_pool:
+            return
+        batch, self._turn_buf = self._turn_buf, []
+        try:
             async with self.pg_pool.acquire() as conn:
-                await conn.execute(
-                    "INSERT INTO memory_turns(user_id, role, content) VALUES($1, $2, $3)",
-                    user_id,
-                    role,
-                    clipped,
+                await conn.copy_records_to_table(
+                    "memory_turns",
+                    records=batch,
+                    columns=["user_id", "role", "content_z"],
                 )
+        except Exception:
+            LOGGER.exception("Failed to flush %s memory turns to Postgres", len(batch))
 
     async def remember_fact(self, user_id: int, fact_text: str) -> None:
+        await self.remember_facts(user_id, [fact_text])
+
+    async def remember_facts(self, user_id: int, facts: list[str]) -> None:
         if not self.settings.memory_enabled or not self.vector_enabled or not self.pg_pool:
             return
-        text = fact_text.strip()
-        if len(text) < 20:
+        texts = [text for text in (f.strip() for f in facts) if len(text) >= 20]
+        if not texts:
             return
 
-        vector = await self._embed(text)
-        if not vector:
+        # Эмбеддинги уходят одной пачкой через батчер, строки — одним COPY.
+        vectors = await asyncio.gather(*(self._embed(text) for text in texts))
+        records = [(user_id, text[:2000], vector) for text, vector in zip(texts, vectors) if vector]
+        if not records:
             return
 
         async with self.pg_pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO memory_facts(user_id, fact_text, embedding) VALUES($1, $2, $3::vector)",
-                user_id,
-                text[:2000],
-                vector,
+            await conn.copy_records_to_table(
+                "memory_facts",
+                records=records,
+                columns=["user_id", "fact_text", "embedding"],
             )
 
     async def get_context(self, user_id: int, query: str) -> dict[str, list[str]]:
@@ -136,36 +391,20 @@ class MemoryStore:
         if self.redis:
             items = await self.redis.lrange(f"mem:recent:{user_id}", 0, self.settings.memory_recent_turns - 1)
             for raw in reversed(items):
-                item = json.loads(raw)
+                item = orjson.loads(raw)
                 recent.append(f"{item.get('role', 'unknown')}: {item.get('content', '')}")
         elif self.pg_pool:
             async with self.pg_pool.acquire() as conn:
-                rows = await conn.fetch(
-                    """
-                    SELECT role, content
-                    FROM memory_turns
-                    WHERE user_id = $1
-                    ORDER BY id DESC
-                    LIMIT $2
-                    """,
-                    user_id,
-                    self.settings.memory_recent_turns,
-                )
+                rows = await conn.fetch(_SQL_RECENT_TURNS, user_id, self.settings.memory_recent_turns)
                 for row in reversed(rows):
-                    recent.append(f"{row['role']}: {row['content']}")
+                    recent.append(f"{row['role']}: {self._turn_text(row)}")
 
         if self.vector_enabled and self.pg_pool and query.strip():
             q_vector = await self._embed(query.strip()[:4000])
             if q_vector:
                 async with self.pg_pool.acquire() as conn:
                     rows = await conn.fetch(
-                        """
-                        SELECT fact_text
-                        FROM memory_facts
-                        WHERE user_id = $1
-                        ORDER BY embedding <=> $2::vector
-                        LIMIT $3
-                        """,
+                        _SQL_NEAREST_FACTS,
                         user_id,
                         q_vector,
                         self.settings.memory_semantic_k,
@@ -174,17 +413,76 @@ class MemoryStore:
 
         return {"recent": recent, "semantic": semantic}
 
-    async def _embed(self, text: str) -> str | None:
+    async def get_cached_reply(self, user_id: int, scope: str, query: str) -> str | None:
+        """Ответ на дословно тот же вопрос этого пользователя в том же scope (срез Notion + диалог)."""
+        if not self.settings.memory_enabled:
+            return None
+        normalized = _normalize_query(query)
+        if len(normalized) < REPLY_CACHE_MIN_CHARS:
+            return None
+        digest = _query_digest(normalized)
+
+        # Кэш живёт в одном хранилище: Redis, если он есть, иначе Postgres.
+        if self.redis:
+            return await self.redis.get(_reply_cache_key(user_id, scope, digest))
+        if not self.pg_pool:
+            return None
+        async with self.pg_pool.acquire() as conn:
+            return await conn.fetchval(_SQL_CACHED_REPLY, user_id, scope, digest, float(REPLY_CACHE_TTL_SEC))
+
+    async def cache_reply(self, user_id: int, scope: str, query: str, answer: str) -> None:
+        if not self.settings.memory_enabled:
+            return
+        normalized = _normalize_query(query)
+        if len(normalized) < REPLY_CACHE_MIN_CHARS or not answer.strip():
+            return
+        digest = _query_digest(normalized)
+
+        if self.redis:
+            await self.redis.set(_reply_cache_key(user_id, scope, digest), answer, ex=REPLY_CACHE_TTL_SEC)
+            return
+        if not self.pg_pool:
+            return
+        async with self.pg_pool.acquire() as conn:
+            await conn.execute(_SQL_PRUNE_REPLIES, user_id, float(REPLY_CACHE_TTL_SEC))
+            await conn.execute(_SQL_INSERT_REPLY, user_id, scope, digest, answer)
+
+    def _turn_text(self, row: asyncpg.Record) -> str:
+        if row["content_z"] is not None:
+            return self._zdctx.decompress(row["content_z"]).decode("utf-8")
+        return row["content"] or ""
+
+    async def _embed(self, text: str) -> list[float] | None:
+        # Склеиваются только одновременные запросы одного и того же текста (например, дубли
+        # сообщения): запись удаляется сразу после ответа, результат между вызовами не хранится.
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        while (inflight := self._embed_inflight.get(key)) is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if not inflight.cancelled() or (task is not None and task.cancelling()):
+                    raise
+                # Отменили ведущий вызов, а не нас: эмбеддим сами.
+            except Exception:
+                return None
+
+        future: asyncio.Future[list[float]] = asyncio.get_running_loop().create_future()
+        self._embed_inflight[key] = future
         try:
-            response = await self.openai.embeddings.create(
-                model=self.settings.memory_embed_model,
-                input=text,
-            )
-            vector = response.data[0].embedding
-            return "[" + ",".join(f"{x:.8f}" for x in vector) + "]"
+            vector = await self.embedder.embed(text)
+            future.set_result(vector)
+            return vector
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
         except Exception as exc:
             LOGGER.warning("Embedding failed: %s", exc)
+            future.set_exception(exc)
+            future.exception()
             return None
+        finally:
+            self._embed_inflight.pop(key, None)
 
     @staticmethod
     def format_context(memory: dict[str, list[str]]) -> str:
@@ -196,3 +494,23 @@ class MemoryStore:
         if semantic:
             blocks.append("Долгосрочная релевантная память:\n" + "\n".join(f"- {x}" for x in semantic[:8]))
         return "\n\n".join(blocks)
+
+
+def _ann_index_method(indexdef: str | None) -> str | None:
+    definition = (indexdef or "").lower()
+    for method in ("hnsw", "ivfflat"):
+        if f"using {method}" in definition:
+            return method
+    return None
+
+
+def _normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _query_digest(normalized_query: str) -> str:
+    return hashlib.sha256(normalized_query.encode("utf-8")).hexdigest()
+
+
+def _reply_cache_key(user_id: int, scope: str, query_digest: str) -> str:
+    return f"mem:reply:{user_id}:{scope}:{query_digest}"
@@ -1,11 +1,136 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any
-
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, TypeVar
+
+import httpx
 from notion_client import AsyncClient
 from notion_client.errors import APIResponseError
 
+LOGGER = logging.getLogger(__name__)
+ROW_CACHE_TTL_SEC = 60.0
+SEARCH_PAGE_SIZES = (5, 20)
+ACTION_CONCURRENCY = 5
+RATE_LIMIT_MAX_ATTEMPTS = 4
+
+_T = TypeVar("_T")
+
+# Один AsyncClient на токен: пул keep-alive соединений переживает отдельные экземпляры NotionService.
+_SHARED_CLIENTS: dict[str, AsyncClient] = {}
+
+
+def _get_shared_client(token: str) -> AsyncClient:
+    client = _SHARED_CLIENTS.get(token)
+    if client is None:
+        # Notion — один HTTPS-хост: HTTP/2 мультиплексирует параллельные запросы поверх одного соединения.
+        http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=60),
+        )
+        client = AsyncClient(auth=token, client=http_client)
+        _SHARED_CLIENTS[token] = client
+    return client
+
+
+async def _rl_call(method: Callable[..., Awaitable[_T]], **kwargs: Any) -> _T:
+    # Notion отвечает 429 с Retry-After: ждём указанное время (или растущую паузу) плюс джиттер.
+    for attempt in range(RATE_LIMIT_MAX_ATTEMPTS - 1):
+        try:
+            return await method(**kwargs)
+        except APIResponseError as exc:
+            if exc.code != "rate_limited":
+                raise
+            try:
+                delay = float(exc.headers.get("Retry-After", ""))
+            except ValueError:
+                delay = 0.5 * 2**attempt
+            LOGGER.warning("Notion rate limited, retrying in %.1fs", delay)
+            await asyncio.sleep(delay + random.uniform(0, 0.25))
+    return await method(**kwargs)
+
+
+# Схемы баз COO workspace: неизменны, поэтому собираются один раз при импорте.
+_PROJECTS_SCHEMA: dict[str, Any] = {
+    "Name": {"title": {}},
+    "Status": {
+        "select": {
+            "options": [
+                {"name": "Main"},
+                {"name": "Support"},
+                {"name": "Experiment"},
+                {"name": "Paused"},
+                {"name": "Done"},
+            ]
+        }
+    },
+    "KPI": {"rich_text": {}},
+    "Notes": {"rich_text": {}},
+}
+
+_TASKS_SCHEMA: dict[str, Any] = {
+    "Name": {"title": {}},
+    "Status": {
+        "select": {
+            "options": [
+                {"name": "Todo"},
+                {"name": "Doing"},
+                {"name": "Done"},
+                {"name": "Paused"},
+            ]
+        }
+    },
+    "Priority": {
+        "select": {
+            "options": [
+                {"name": "High"},
+                {"name": "Medium"},
+                {"name": "Low"},
+            ]
+        }
+    },
+    "Project": {"rich_text": {}},
+    "Energy": {
+        "select": {
+            "options": [
+                {"name": "High"},
+                {"name": "Normal"},
+                {"name": "Low"},
+            ]
+        }
+    },
+}
+
+_MEMORY_SCHEMA: dict[str, Any] = {
+    "Name": {"title": {}},
+    "UserId": {"number": {}},
+    "Role": {
+        "select": {
+            "options": [
+                {"name": "user"},
+                {"name": "assistant"},
+                {"name": "system"},
+            ]
+        }
+    },
+    "Text": {"rich_text": {}},
+    "At": {"date": {}},
+}
+
+# Общая пустая заглушка для разбора свойств: только читается, не мутируется.
+_EMPTY: dict[str, Any] = {}
+
+_TASK_PRIORITIES = frozenset({"High", "Medium", "Low"})
+_TASK_STATUSES = frozenset({"Todo", "Doing", "Done", "Paused"})
+_PROJECT_STATUSES = frozenset({"Main", "Support", "Experiment", "Paused", "Done"})
+_MEMORY_ROLES = frozenset({"user", "assistant", "system"})
+
 
 @dataclass
 class NotionIds:
@@ -25,109 +150,73 @@ class NotionService:
         tasks_db_id: str | None = None,
         projects_db_id: str | None = None,
         memory_db_id: str | None = None,
+        snapshot_ttl_sec: float = 45.0,
+        state_path: str = ".coo_state.json",
     ) -> None:
-        self.client = AsyncClient(auth=token)
+        # Клиент общий для всех экземпляров — не закрывайте его через `async with` в рабочем коде.
+        self.client = _get_shared_client(token)
+        self._action_semaphore = asyncio.Semaphore(ACTION_CONCURRENCY)
+        self._prefetch_task: asyncio.Task[str] | None = None
         self.parent_page_id = parent_page_id
         self.source_db_ids = source_db_ids or []
         self.cached_ids: NotionIds | None = None
+        self.snapshot_ttl_sec = snapshot_ttl_sec
+        self.state_path = state_path
+        self._snapshot_cache: tuple[float, str] | None = None
+        self._snapshot_generation = 0
+        self._snapshot_lock = asyncio.Lock()
+        # database_id -> ID свойств, которые реально читает снапшот (для filter_properties).
+        self._property_ids: dict[str, list[str]] = {}
+        # (database_id, название в нижнем регистре) -> (время, page_id) для обновлений статуса по имени.
+        self._row_cache: dict[tuple[str, str], tuple[float, str]] = {}
         if workspace_page_id and tasks_db_id and projects_db_id and memory_db_id:
             self.cached_ids = NotionIds(workspace_page_id, tasks_db_id, projects_db_id, memory_db_id)
+            self._ids_from_state = False
+        else:
+            # ID стабильны между рестартами: если уже находили их, поиск по workspace не нужен.
+            self.cached_ids = self._load_state()
+            self._ids_from_state = self.cached_ids is not None
+
+    @classmethod
+    async def aclose_all(cls) -> None:
+        while _SHARED_CLIENTS:
+            _, client = _SHARED_CLIENTS.popitem()
+            await client.aclose()
+
+    async def close(self) -> None:
+        if self._prefetch_task is not None:
+            self._prefetch_task.cancel()
 
     async def ensure_workspace(self) -> NotionIds:
         if self.cached_ids:
             return self.cached_ids
 
-        workspace_page_id = await self._find_page_id_by_title("COO Workspace")
+        workspace_page_id, projects_db_id, tasks_db_id, memory_db_id = await asyncio.gather(
+            self._find_page_id_by_title("COO Workspace"),
+            self._find_database_id_by_title("COO Projects"),
+            self._find_database_id_by_title("COO Tasks"),
+            self._find_database_id_by_title("COO Memory"),
+        )
         if not workspace_page_id:
             page = await self._create_workspace_page()
             workspace_page_id = page["id"]
 
-        projects_db_id = await self._find_database_id_by_title("COO Projects")
+        # Базы независимы друг от друга — создаём недостающие одновременно.
+        pending: dict[str, Coroutine[Any, Any, str]] = {}
         if not projects_db_id:
-            db = await self.client.databases.create(
-                parent={"type": "page_id", "page_id": workspace_page_id},
-                title=[{"type": "text", "text": {"content": "COO Projects"}}],
-                properties={
-                    "Name": {"title": {}},
-                    "Status": {
-                        "select": {
-                            "options": [
-                                {"name": "Main"},
-                                {"name": "Support"},
-                                {"name": "Experiment"},
-                                {"name": "Paused"},
-                                {"name": "Done"},
-                            ]
-                        }
-                    },
-                    "KPI": {"rich_text": {}},
-                    "Notes": {"rich_text": {}},
-                },
-            )
-            projects_db_id = db["id"]
+            pending["projects"] = self._create_database(workspace_page_id, "COO Projects", _PROJECTS_SCHEMA)
 
-        tasks_db_id = await self._find_database_id_by_title("COO Tasks")
         if not tasks_db_id:
-            db = await self.client.databases.create(
-                parent={"type": "page_id", "page_id": workspace_page_id},
-                title=[{"type": "text", "text": {"content": "COO Tasks"}}],
-                properties={
-                    "Name": {"title": {}},
-                    "Status": {
-                        "select": {
-                            "options": [
-                                {"name": "Todo"},
-                                {"name": "Doing"},
-                                {"name": "Done"},
-                                {"name": "Paused"},
-                            ]
-                        }
-                    },
-                    "Priority": {
-                        "select": {
-                            "options": [
-                                {"name": "High"},
-                                {"name": "Medium"},
-                                {"name": "Low"},
-                            ]
-                        }
-                    },
-                    "Project": {"rich_text": {}},
-                    "Energy": {
-                        "select": {
-                            "options": [
-                                {"name": "High"},
-                                {"name": "Normal"},
-                                {"name": "Low"},
-                            ]
-                        }
-                    },
-                },
-            )
-            tasks_db_id = db["id"]
+            pending["tasks"] = self._create_database(workspace_page_id, "COO Tasks", _TASKS_SCHEMA)
 
-        memory_db_id = await self._find_database_id_by_title("COO Memory")
         if not memory_db_id:
-            db = await self.client.databases.create(
-                parent={"type": "page_id", "page_id": workspace_page_id},
-                title=[{"type": "text", "text": {"content": "COO Memory"}}],
-                properties={
-                    "Name": {"title": {}},
-                    "UserId": {"number": {}},
-                    "Role": {
-                        "select": {
-                            "options": [
-                                {"name": "user"},
-                                {"name": "assistant"},
-                                {"name": "system"},
-                            ]
-                        }
-                    },
-                    "Text": {"rich_text": {}},
-                    "At": {"date": {}},
-                },
-            )
-            memory_db_id = db["id"]
+            pending["memory"] = self._create_database(workspace_page_id, "COO Memory", _MEMORY_SCHEMA)
+
+        if pending:
+            created = dict(zip(pending, await asyncio.gather(*pending.values())))
+            projects_db_id = created.get("projects", projects_db_id)
+            tasks_db_id = created.get("tasks", tasks_db_id)
+            memory_db_id = created.get("memory", memory_db_id)
 
         self.cached_ids = NotionIds(
             workspace_page_id=workspace_page_id,
@@ -135,17 +224,68 @@ class NotionService:
             projects_db_id=projects_db_id,
             memory_db_id=memory_db_id,
         )
+        await asyncio.to_thread(self._save_state, self.cached_ids)
+        self.prefetch_snapshot()
         return self.cached_ids
 
+    def prefetch_snapshot(self) -> None:
+        # Первый /focus или ответ после старта берёт срез из кэша, а не ждёт Notion.
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            return
+        self._prefetch_task = asyncio.create_task(self.get_focus_snapshot())
+        self._prefetch_task.add_done_callback(_log_prefetch_failure)
+
+    async def _create_database(self, workspace_page_id: str, title: str, properties: dict[str, Any]) -> str:
+        db = await _rl_call(
+            self.client.databases.create,
+            parent={"type": "page_id", "page_id": workspace_page_id},
+            title=[{"type": "text", "text": {"content": title}}],
+            properties=properties,
+        )
+        return db["id"]
+
+    def _load_state(self) -> NotionIds | None:
+        try:
+            with open(self.state_path, encoding="utf-8") as fh:
+                return NotionIds(**json.load(fh))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            LOGGER.warning("Ignoring unreadable Notion state file %s", self.state_path, exc_info=True)
+            return None
+
+    def _forget_state(self) -> None:
+        self.cached_ids = None
+        self._ids_from_state = False
+        self._property_ids.clear()
+        self._row_cache.clear()
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            LOGGER.warning("Failed to remove Notion state file %s", self.state_path, exc_info=True)
+
+    def _save_state(self, ids: NotionIds) -> None:
+        try:
+            directory = os.path.dirname(os.path.abspath(self.state_path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".coo_state.", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(asdict(ids), fh)
+            os.replace(tmp_path, self.state_path)
+        except Exception:
+            LOGGER.warning("Failed to persist Notion state to %s", self.state_path, exc_info=True)
+
     async def add_memory_entry(self, user_id: int, role: str, text: str) -> str:
-        ids = await self.ensure_workspace()
+        ids = self.cached_ids or await self.ensure_workspace()
         now_iso = _utc_now_iso()
-        page = await self.client.pages.create(
+        page = await _rl_call(
+            self.client.pages.create,
             parent={"database_id": ids.memory_db_id},
             properties={
                 "Name": {"title": [{"type": "text", "text": {"content": f"{role}:{text[:60]}"}}]},
                 "UserId": {"number": user_id},
-                "Role": {"select": {"name": role if role in {"user", "assistant", "system"} else "system"}},
+                "Role": {"select": {"name": role if role in _MEMORY_ROLES else "system"}},
                 "Text": {"rich_text": [{"type": "text", "text": {"content": text[:2000]}}]},
                 "At": {"date": {"start": now_iso}},
             },
@@ -153,8 +293,9 @@ class NotionService:
         return page["id"]
 
     async def get_memory_context(self, user_id: int, limit: int = 12) -> str:
-        ids = await self.ensure_workspace()
-        data = await self.client.databases.query(
+        ids = self.cached_ids or await self.ensure_workspace()
+        data = await _rl_call(
+            self.client.databases.query,
             database_id=ids.memory_db_id,
             filter={"property": "UserId", "number": {"equals": user_id}},
             sorts=[{"property": "At", "direction": "ascending"}],
@@ -170,8 +311,9 @@ class NotionService:
         return "\n".join(lines[-limit:])
 
     async def add_task(self, text: str, project: str = "", priority: str = "Medium") -> str:
-        ids = await self.ensure_workspace()
-        page = await self.client.pages.create(
+        ids = self.cached_ids or await self.ensure_workspace()
+        page = await _rl_call(
+            self.client.pages.create,
             parent={"database_id": ids.tasks_db_id},
             properties={
                 "Name": {"title": [{"type": "text", "text": {"content": text[:2000]}}]},
@@ -183,11 +325,13 @@ class NotionService:
                 "Energy": {"select": {"name": "Normal"}},
             },
         )
+        self.invalidate_snapshot()
         return page["id"]
 
     async def add_project(self, name: str, status: str = "Experiment", kpi: str = "") -> str:
-        ids = await self.ensure_workspace()
-        page = await self.client.pages.create(
+        ids = self.cached_ids or await self.ensure_workspace()
+        page = await _rl_call(
+            self.client.pages.create,
             parent={"database_id": ids.projects_db_id},
             properties={
                 "Name": {"title": [{"type": "text", "text": {"content": name[:2000]}}]},
@@ -195,36 +339,95 @@ class NotionService:
                 "KPI": {"rich_text": [{"type": "text", "text": {"content": kpi[:1000]}}]},
             },
         )
+        self.invalidate_snapshot()
         return page["id"]
 
-    async def get_focus_snapshot(self) -> str:
-        ids = await self.ensure_workspace()
+    def invalidate_snapshot(self) -> None:
+        self._snapshot_cache = None
+        self._snapshot_generation += 1
+
+    def _fresh_snapshot(self) -> str | None:
+        if self._snapshot_cache and time.monotonic() - self._snapshot_cache[0] < self.snapshot_ttl_sec:
+            return self._snapshot_cache[1]
+        return None
 
-        projects = await self.client.databases.query(
-            database_id=ids.projects_db_id,
-            filter={"property": "Status", "select": {"does_not_equal": "Done"}},
-            page_size=10,
+    async def get_focus_snapshot(self) -> str:
+        cached = self._fresh_snapshot()
+        if cached is not None:
+            return cached
+        # Одновременные промахи кэша ждут одну загрузку вместо параллельных запросов в Notion.
+        async with self._snapshot_lock:
+            cached = self._fresh_snapshot()
+            if cached is not None:
+                return cached
+            generation = self._snapshot_generation
+            try:
+                snapshot = await self._load_focus_snapshot()
+            except APIResponseError as exc:
+                if exc.code != "object_not_found" or not self._ids_from_state:
+                    raise
+                # Сохранённые ID устарели (базы удалили или пересоздали) — находим workspace заново.
+                LOGGER.warning("Stored Notion ids are stale, rediscovering workspace")
+                self._forget_state()
+                snapshot = await self._load_focus_snapshot()
+            if generation == self._snapshot_generation:
+                self._snapshot_cache = (time.monotonic(), snapshot)
+            return snapshot
+
+    async def _get_property_ids(self, database_id: str, names: tuple[str, ...]) -> list[str]:
+        cached = self._property_ids.get(database_id)
+        if cached is not None:
+            return cached
+        try:
+            db = await _rl_call(self.client.databases.retrieve, database_id=database_id)
+        except APIResponseError:
+            # Без ID свойств просто запрашиваем строки целиком.
+            LOGGER.warning("Failed to resolve property ids for database %s", database_id)
+            return []
+        props = db.get("properties", {})
+        property_ids = [props[name]["id"] for name in names if name in props]
+        self._property_ids[database_id] = property_ids
+        return property_ids
+
+    async def _load_focus_snapshot(self) -> str:
+        ids = self.cached_ids or await self.ensure_workspace()
+
+        project_props, task_props = await asyncio.gather(
+            self._get_property_ids(ids.projects_db_id, ("Name", "Status")),
+            self._get_property_ids(ids.tasks_db_id, ("Name", "Status", "Priority")),
         )
-        tasks = await self.client.databases.query(
-            database_id=ids.tasks_db_id,
-            filter={"property": "Status", "select": {"does_not_equal": "Done"}},
-            page_size=12,
+        projects, tasks = await asyncio.gather(
+            _rl_call(
+                self.client.databases.query,
+                database_id=ids.projects_db_id,
+                filter={"property": "Status", "select": {"does_not_equal": "Done"}},
+                page_size=10,
+                filter_properties=project_props,
+            ),
+            _rl_call(
+                self.client.databases.query,
+                database_id=ids.tasks_db_id,
+                filter={"property": "Status", "select": {"does_not_equal": "Done"}},
+                page_size=12,
+                filter_properties=task_props,
+            ),
         )
 
-        project_lines = []
-        for item in projects.get("results", []):
-            props = item.get("properties", {})
-            name = _extract_title(props.get("Name", {}))
-            status = ((props.get("Status", {}) or {}).get("select") or {}).get("name", "Unknown")
-            project_lines.append(f"- {name} [{status}]")
-
-        task_lines = []
-        for item in tasks.get("results", []):
-            props = item.get("properties", {})
-            name = _extract_title(props.get("Name", {}))
-            status = ((props.get("Status", {}) or {}).get("select") or {}).get("name", "?")
-            prio = ((props.get("Priority", {}) or {}).get("select") or {}).get("name", "?")
-            task_lines.append(f"- {name} ({status}, {prio})")
+        project_rows = [
+            (item["id"], _row_summary(item.get("properties") or _EMPTY, "Unknown"))
+            for item in projects.get("results", [])
+        ]
+        task_rows = [
+            (item["id"], _row_summary(item.get("properties") or _EMPTY, "?"))
+            for item in tasks.get("results", [])
+        ]
+        for page_id, (name, _, _) in project_rows:
+            self._remember_row(ids.projects_db_id, name, page_id)
+        for page_id, (name, _, _) in task_rows:
+            self._remember_row(ids.tasks_db_id, name, page_id)
+
+        project_lines = [f"- {name} [{status}]" for _, (name, status, _) in project_rows]
+        task_lines = [f"- {name} ({status}, {prio})" for _, (name, status, prio) in task_rows]
 
         projects_text = "\n".join(project_lines) if project_lines else "- нет активных проектов"
         tasks_text = "\n".join(task_lines) if task_lines else "- нет активных задач"
@@ -239,29 +442,49 @@ class NotionService:
         if not self.source_db_ids:
             return ""
 
-        sections: list[str] = []
-        for db_id in self.source_db_ids:
-            try:
-                db = await self.client.databases.retrieve(database_id=db_id)
-                db_title = "".join(t.get("plain_text", "") for t in db.get("title", [])) or f"DB {db_id[:8]}"
-                query = await self.client.databases.query(database_id=db_id, page_size=limit_per_db)
-
-                rows: list[str] = []
-                for item in query.get("results", []):
-                    props = item.get("properties", {})
-                    rows.append(f"- {_extract_best_row_summary(props)}")
-
-                block = f"Источник: {db_title} ({db_id})\n"
-                block += "\n".join(rows) if rows else "- нет записей"
-                sections.append(block)
-            except Exception as exc:
-                sections.append(f"Источник: {db_id}\n- ошибка чтения: {exc}")
-
+        sections = await asyncio.gather(
+            *(self._read_external_source(db_id, limit_per_db) for db_id in self.source_db_ids)
+        )
         if not sections:
             return ""
         return "\n\n".join(sections)
 
+    async def _read_external_source(self, db_id: str, limit_per_db: int) -> str:
+        try:
+            db, query = await asyncio.gather(
+                _rl_call(self.client.databases.retrieve, database_id=db_id),
+                _rl_call(self.client.databases.query, database_id=db_id, page_size=limit_per_db),
+            )
+        except Exception as exc:
+            return f"Источник: {db_id}\n- ошибка чтения: {exc}"
+
+        db_title = "".join([t.get("plain_text", "") for t in db.get("title", [])]) or f"DB {db_id[:8]}"
+        rows: list[str] = []
+        for item in query.get("results", []):
+            props = item.get("properties", {})
+            rows.append(f"- {_extract_best_row_summary(props)}")
+
+        block = f"Источник: {db_title} ({db_id})\n"
+        block += "\n".join(rows) if rows else "- нет записей"
+        return block
+
+    async def execute_actions(self, actions: list[dict[str, Any]]) -> list[str | BaseException]:
+        if not actions:
+            return []
+        # Один поиск workspace на всю пачку, а не гонка из N параллельных discovery.
+        ids = self.cached_ids or await self.ensure_workspace()
+        # Ошибка одного действия не отменяет остальные: исключение возвращается на его месте.
+        return await asyncio.gather(*(self._dispatch_limited(a, ids) for a in actions), return_exceptions=True)
+
     async def execute_action(self, action: dict[str, Any]) -> str:
+        ids = self.cached_ids or await self.ensure_workspace()
+        return await self._dispatch(action, ids)
+
+    async def _dispatch_limited(self, action: dict[str, Any], ids: NotionIds) -> str:
+        async with self._action_semaphore:
+            return await self._dispatch(action, ids)
+
+    async def _dispatch(self, action: dict[str, Any], ids: NotionIds) -> str:
         action_type = str(action.get("type", "")).strip()
         if action_type == "add_task":
             task_id = await self.add_task(
@@ -282,54 +505,73 @@ class NotionService:
         if action_type == "update_task_status":
             title = str(action.get("title", "")).strip()
             status = _safe_task_status(str(action.get("status", "Todo")))
-            ok = await self.update_task_status_by_name(title=title, status=status)
+            ok = await self.update_task_status_by_name(title=title, status=status, ids=ids)
             return f"Статус задачи обновлён: {title} -> {status}" if ok else f"Задача не найдена: {title}"
 
         if action_type == "update_project_status":
             name = str(action.get("name", "")).strip()
             status = _safe_project_status(str(action.get("status", "Paused")))
-            ok = await self.update_project_status_by_name(name=name, status=status)
+            ok = await self.update_project_status_by_name(name=name, status=status, ids=ids)
             return f"Статус проекта обновлён: {name} -> {status}" if ok else f"Проект не найден: {name}"
 
         return "Пропущено: неизвестное действие"
 
-    async def update_task_status_by_name(self, title: str, status: str) -> bool:
+    async def update_task_status_by_name(self, title: str, status: str, *, ids: NotionIds | None = None) -> bool:
         if not title:
             return False
-        ids = await self.ensure_workspace()
-        row = await self._find_task_row_by_name(ids.tasks_db_id, title)
-        if not row:
-            return False
-        await self.client.pages.update(
-            page_id=row["id"],
-            properties={"Status": {"select": {"name": status}}},
-        )
-        return True
+        ids = ids or self.cached_ids or await self.ensure_workspace()
+        return await self._update_status_by_name(ids.tasks_db_id, title, status)
 
-    async def update_project_status_by_name(self, name: str, status: str) -> bool:
+    async def update_project_status_by_name(self, name: str, status: str, *, ids: NotionIds | None = None) -> bool:
         if not name:
             return False
-        ids = await self.ensure_workspace()
-        row = await self._find_project_row_by_name(ids.projects_db_id, name)
-        if not row:
-            return False
-        await self.client.pages.update(
-            page_id=row["id"],
-            properties={"Status": {"select": {"name": status}}},
-        )
-        return True
+        ids = ids or self.cached_ids or await self.ensure_workspace()
+        return await self._update_status_by_name(ids.projects_db_id, name, status)
+
+    async def _update_status_by_name(self, db_id: str, name: str, status: str) -> bool:
+        for _ in range(2):
+            row = await self._find_row_by_name(db_id, name)
+            if not row:
+                return False
+            try:
+                await _rl_call(
+                    self.client.pages.update,
+                    page_id=row["id"],
+                    properties={"Status": {"select": {"name": status}}},
+                )
+            except APIResponseError as exc:
+                # Закэшированная строка могла быть удалена — забываем её и ищем заново.
+                if exc.code != "object_not_found":
+                    raise
+                self._row_cache.pop((db_id, name.strip().lower()), None)
+                continue
+            self.invalidate_snapshot()
+            return True
+        return False
 
     async def _find_page_id_by_title(self, title: str) -> str | None:
-        result = await self.client.search(
-            query=title,
-            filter={"property": "object", "value": "page"},
-            page_size=20,
-        )
-        for item in result.get("results", []):
+        async for item in self._search(title, "page"):
             if _extract_title(item.get("properties", {}).get("title", {})) == title:
                 return item.get("id")
         return None
 
+    async def _search(self, query: str, object_type: str) -> AsyncIterator[dict[str, Any]]:
+        # Нужный объект обычно в начале выдачи: сначала маленькая страница, следующая — только при промахе.
+        kwargs: dict[str, Any] = {}
+        for page_size in SEARCH_PAGE_SIZES:
+            result = await _rl_call(
+                self.client.search,
+                query=query,
+                filter={"property": "object", "value": object_type},
+                page_size=page_size,
+                **kwargs,
+            )
+            for item in result.get("results", []):
+                yield item
+            if not result.get("has_more") or not result.get("next_cursor"):
+                return
+            kwargs["start_cursor"] = result["next_cursor"]
+
     async def _create_workspace_page(self) -> dict[str, Any]:
         payload = {
             "properties": {
@@ -346,7 +588,8 @@ class NotionService:
 
         if self.parent_page_id:
             try:
-                return await self.client.pages.create(
+                return await _rl_call(
+                    self.client.pages.create,
                     parent={"type": "page_id", "page_id": self.parent_page_id},
                     **payload,
                 )
@@ -354,62 +597,86 @@ class NotionService:
                 if exc.code not in {"object_not_found", "validation_error"}:
                     raise
 
-        return await self.client.pages.create(
+        return await _rl_call(
+            self.client.pages.create,
             parent={"workspace": True},
             **payload,
         )
 
     async def _find_database_id_by_title(self, title: str) -> str | None:
-        result = await self.client.search(
-            query=title,
-            filter={"property": "object", "value": "database"},
-            page_size=20,
-        )
-        for item in result.get("results", []):
-            db_title = "".join(t.get("plain_text", "") for t in item.get("title", []))
+        async for item in self._search(title, "database"):
+            db_title = "".join([t.get("plain_text", "") for t in item.get("title", [])])
             if db_title == title:
                 return item.get("id")
         return None
 
-    async def _find_task_row_by_name(self, db_id: str, name: str) -> dict[str, Any] | None:
-        result = await self.client.databases.query(database_id=db_id, page_size=50)
-        target = name.lower().strip()
-        for item in result.get("results", []):
-            props = item.get("properties", {})
-            current = _extract_title(props.get("Name", {})).lower().strip()
-            if current == target:
-                return item
-        for item in result.get("results", []):
-            props = item.get("properties", {})
-            current = _extract_title(props.get("Name", {})).lower().strip()
-            if target and target in current:
+    def _remember_row(self, db_id: str, name: str, page_id: str) -> None:
+        self._row_cache[(db_id, name.strip().lower())] = (time.monotonic(), page_id)
+
+    async def _find_row_by_name(self, db_id: str, name: str) -> dict[str, Any] | None:
+        target = name.strip()
+        if not target:
+            return None
+        cached = self._row_cache.get((db_id, target.lower()))
+        if cached and time.monotonic() - cached[0] < ROW_CACHE_TTL_SEC:
+            return {"id": cached[1]}
+        row = await self._query_row_by_name(db_id, target)
+        if row:
+            self._remember_row(db_id, target, row["id"])
+        return row
+
+    async def _query_row_by_name(self, db_id: str, target: str) -> dict[str, Any] | None:
+        # Сопоставление делает Notion: сначала точное совпадение, затем подстрока.
+        exact = await _rl_call(
+            self.client.databases.query,
+            database_id=db_id,
+            filter={"property": "Name", "title": {"equals": target}},
+            page_size=1,
+        )
+        if exact.get("results"):
+            return exact["results"][0]
+
+        partial = await _rl_call(
+            self.client.databases.query,
+            database_id=db_id,
+            filter={"property": "Name", "title": {"contains": target}},
+            page_size=50,
+        )
+        results = partial.get("results", [])
+        lowered = target.lower()
+        target_len = len(lowered)
+        for item in results:
+            raw = _extract_title(item.get("properties", {}).get("Name", {})).strip()
+            # Строку другой длины не приводим к нижнему регистру — точным совпадением она не будет.
+            if len(raw) == target_len and raw.lower() == lowered:
                 return item
-        return None
+        # Подстрока подходит, только если кандидат один: иначе легко обновить не ту строку.
+        return results[0] if len(results) == 1 else None
 
-    async def _find_project_row_by_name(self, db_id: str, name: str) -> dict[str, Any] | None:
-        result = await self.client.databases.query(database_id=db_id, page_size=50)
-        target = name.lower().strip()
-        for item in result.get("results", []):
-            props = item.get("properties", {})
-            current = _extract_title(props.get("Name", {})).lower().strip()
-            if current == target:
-                return item
-        for item in result.get("results", []):
-            props = item.get("properties", {})
-            current = _extract_title(props.get("Name", {})).lower().strip()
-            if target and target in current:
-                return item
-        return None
+
+def _log_prefetch_failure(task: asyncio.Task[str]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        LOGGER.warning("Notion snapshot prefetch failed", exc_info=task.exception())
+
+
+def _row_summary(props: dict[str, Any], default: str) -> tuple[str, str, str]:
+    name = _extract_title(props.get("Name") or _EMPTY)
+    status = ((props.get("Status") or _EMPTY).get("select") or _EMPTY).get("name", default)
+    prio = ((props.get("Priority") or _EMPTY).get("select") or _EMPTY).get("name", default)
+    return name, status, prio
 
 
 def _extract_title(prop: dict[str, Any]) -> str:
     parts = prop.get("title", []) if isinstance(prop, dict) else []
-    return "".join(p.get("plain_text", "") for p in parts) or "Без названия"
+    if len(parts) == 1:
+        # Обычно заголовок — один фрагмент: склеивать нечего.
+        return parts[0].get("plain_text") or "Без названия"
+    return "".join([p.get("plain_text", "") for p in parts]) or "Без названия"
 
 
 def _extract_rich_text(prop: dict[str, Any]) -> str:
     parts = prop.get("rich_text", []) if isinstance(prop, dict) else []
-    return "".join(p.get("plain_text", "") for p in parts).strip()
+    return "".join([p.get("plain_text", "") for p in parts]).strip()
 
 
 def _utc_now_iso() -> str:
@@ -431,7 +698,7 @@ def _extract_best_row_summary(properties: dict[str, Any]) -> str:
         elif not status_value and ptype == "select":
             status_value = ((prop.get("select") or {}).get("name") or "").strip()
         elif not title_value and ptype == "rich_text":
-            text = "".join(x.get("plain_text", "") for x in prop.get("rich_text", []))
+            text = "".join([x.get("plain_text", "") for x in prop.get("rich_text", [])])
             if text:
                 title_value = text[:120]
         elif not title_value and ptype == "url":
@@ -447,15 +714,12 @@ def _extract_best_row_summary(properties: dict[str, Any]) -> str:
 
 
 def _safe_task_priority(value: str) -> str:
-    allowed = {"High", "Medium", "Low"}
-    return value if value in allowed else "Medium"
+    return value if value in _TASK_PRIORITIES else "Medium"
 
 
 def _safe_task_status(value: str) -> str:
-    allowed = {"Todo", "Doing", "Done", "Paused"}
-    return value if value in allowed else "Todo"
+    return value if value in _TASK_STATUSES else "Todo"
 
 
 def _safe_project_status(value: str) -> str:
-    allowed = {"Main", "Support", "Experiment", "Paused", "Done"}
-    return value if value in allowed else "Experiment"
+    return value if value in _PROJECT_STATUSES else "Experiment"
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from typing import Final
+
+# Лимит Telegram на текст сообщения — в UTF-16 code units, а не в символах Python.
+TELEGRAM_MESSAGE_LIMIT: Final = 4096
+
+
+def _utf16_width(ch: str) -> int:
+    return 2 if ord(ch) > 0xFFFF else 1
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    chunks: list[str] = []
+    start = 0
+    units = 0
+    last_break = -1
+    for idx, ch in enumerate(text):
+        width = _utf16_width(ch)
+        # Разрез по переводу строки оставляет в текущей части хвост, и символ может
+        # всё ещё не влезать — тогда режем ещё раз, уже жёстко.
+        while units + width > limit:
+            # Режем по последнему переводу строки, если он есть в текущей части.
+            cut = last_break + 1 if last_break >= start else idx
+            chunks.append(text[start:cut])
+            start = cut
+            units = sum(_utf16_width(c) for c in text[start:idx])
+            last_break = -1
+        units += width
+        if ch == "\n":
+            last_break = idx
+    if start < len(text):
+        chunks.append(text[start:])
+    return [chunk for chunk in chunks if chunk.strip()]
@@ -0,0 +1,165 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from openai import BadRequestError
+
+from app import agent
+from app.agent import (
+    _SNAPSHOT_TRUNCATED_MARKER,
+    _SYSTEM_MESSAGES,
+    _Breaker,
+    _build_input,
+    _clip_snapshot,
+    _safe_json,
+)
+
+
+def _make_agent(create: AsyncMock) -> agent.CoAgent:
+    co_agent = agent.CoAgent.__new__(agent.CoAgent)
+    co_agent.client = SimpleNamespace(responses=SimpleNamespace(create=create))
+    co_agent.model = "gpt-5"
+    co_agent._candidate_models = ["gpt-5", "gpt-4.1-mini"]
+    return co_agent
+
+
+def _bad_request() -> BadRequestError:
+    response = httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/responses"))
+    return BadRequestError("context_length_exceeded", response=response, body=None)
+
+
+class ClipSnapshotTest(unittest.TestCase):
+    def test_short_snapshot_is_unchanged(self) -> None:
+        self.assertEqual(_clip_snapshot("abc", max_chars=10), "abc")
+
+    def test_snapshot_at_limit_is_unchanged(self) -> None:
+        self.assertEqual(_clip_snapshot("x" * 10, max_chars=10), "x" * 10)
+
+    def test_long_snapshot_keeps_head_and_tail(self) -> None:
+        snapshot = "H" * 100 + "M" * 100 + "T" * 100
+        clipped = _clip_snapshot(snapshot, max_chars=100)
+
+        self.assertEqual(len(clipped), 100)
+        self.assertIn(_SNAPSHOT_TRUNCATED_MARKER, clipped)
+        self.assertTrue(clipped.startswith("H"))
+        self.assertTrue(clipped.endswith("T"))
+
+
+class BuildInputTest(unittest.TestCase):
+    def test_memory_block_is_not_clipped_with_snapshot(self) -> None:
+        memory_block = "Краткая история диалога:\n- user: привет"
+        messages = _build_input(_SYSTEM_MESSAGES, "N" * 50_000, memory_block, "вопрос")
+
+        context = messages[len(_SYSTEM_MESSAGES)]["content"]
+        self.assertTrue(context.endswith(memory_block))
+        self.assertEqual(messages[-1], {"role": "user", "content": "вопрос"})
+
+
+class SafeJsonTest(unittest.TestCase):
+    def test_plain_json(self) -> None:
+        self.assertEqual(_safe_json('{"a": 1}'), {"a": 1})
+
+    def test_fenced_json(self) -> None:
+        self.assertEqual(_safe_json('```json\n{"a": 1}\n```'), {"a": 1})
+
+    def test_trailing_fence_only(self) -> None:
+        self.assertEqual(_safe_json('{"a": 1}\n```'), {"a": 1})
+
+    def test_garbage_returns_none(self) -> None:
+        self.assertIsNone(_safe_json("не json"))
+        self.assertIsNone(_safe_json("```\nне json\n```"))
+
+
+class BreakerTest(unittest.TestCase):
+    def test_closed_open_half_open_closed(self) -> None:
+        breaker = _Breaker(threshold=2, window_sec=30.0, open_sec=60.0)
+        self.assertEqual(breaker.state, "closed")
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        breaker.opened_at -= breaker.open_sec
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.probe_in_flight)
+        # Пока проба в полёте, остальные вызовы не пропускаются.
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertFalse(breaker.probe_in_flight)
+
+    def test_failed_probe_reopens(self) -> None:
+        breaker = _Breaker(threshold=1, window_sec=30.0, open_sec=60.0)
+        breaker.record_failure()
+        breaker.opened_at -= breaker.open_sec
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.probe_in_flight)
+
+
+class ResponsesBreakerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_probe_released_on_cancel(self) -> None:
+        breaker = _Breaker(threshold=1, window_sec=30.0, open_sec=60.0)
+        breaker.record_failure()
+        breaker.opened_at -= breaker.open_sec
+        started = asyncio.Event()
+
+        async def hang(**_: object) -> None:
+            started.set()
+            await asyncio.Event().wait()
+
+        co_agent = _make_agent(AsyncMock(side_effect=hang))
+        with patch.object(agent, "_BREAKER", breaker):
+            task = asyncio.create_task(
+                co_agent._responses_create_with_retries(input_messages=[], temperature=0.2)
+            )
+            await started.wait()
+            self.assertTrue(breaker.probe_in_flight)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        self.assertFalse(breaker.probe_in_flight)
+        self.assertEqual(breaker.state, "half_open")
+
+    async def test_bad_request_on_every_model_does_not_count(self) -> None:
+        breaker = _Breaker(threshold=1, window_sec=30.0, open_sec=60.0)
+        create = AsyncMock(side_effect=_bad_request())
+        co_agent = _make_agent(create)
+
+        with patch.object(agent, "_BREAKER", breaker), self.assertLogs("app.agent", "WARNING"):
+            with self.assertRaises(RuntimeError):
+                await co_agent._responses_create_with_retries(input_messages=[], temperature=0.2)
+
+        self.assertEqual(create.await_count, 2)
+        self.assertEqual(breaker.failures, 0)
+        self.assertEqual(breaker.state, "closed")
+
+    async def test_exhausted_retries_count_one_failure(self) -> None:
+        breaker = _Breaker(threshold=1, window_sec=30.0, open_sec=60.0)
+        request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+        create = AsyncMock(side_effect=agent.APIConnectionError(request=request))
+        co_agent = _make_agent(create)
+
+        with (
+            patch.object(agent, "_BREAKER", breaker),
+            patch.object(agent.asyncio, "sleep", AsyncMock()),
+            self.assertLogs("app.agent", "WARNING"),
+        ):
+            with self.assertRaises(RuntimeError):
+                await co_agent._responses_create_with_retries(input_messages=[], temperature=0.2)
+
+        self.assertEqual(breaker.failures, 1)
+        self.assertEqual(breaker.state, "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
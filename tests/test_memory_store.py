@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from app.memory_store import _ann_index_method, _EmbeddingBatcher
+
+
+class FakeEmbeddings:
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, model: str, input: list[str]) -> SimpleNamespace:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(i)]) for i in range(len(input))])
+
+
+class AnnIndexMethodTest(unittest.TestCase):
+    def test_reads_method_from_index_definition(self) -> None:
+        hnsw = "CREATE INDEX idx_memory_facts_embedding ON public.memory_facts USING hnsw (embedding vector_cosine_ops)"
+        ivfflat = (
+            "CREATE INDEX idx_memory_facts_embedding ON public.memory_facts "
+            "USING ivfflat (embedding vector_cosine_ops) WITH (lists='100')"
+        )
+        self.assertEqual(_ann_index_method(hnsw), "hnsw")
+        self.assertEqual(_ann_index_method(ivfflat), "ivfflat")
+
+    def test_missing_index_has_no_method(self) -> None:
+        self.assertIsNone(_ann_index_method(None))
+
+
+
+class EmbeddingBatcherCloseTest(unittest.IsolatedAsyncioTestCase):
+    async def test_close_waits_for_sent_batch(self) -> None:
+        embeddings = FakeEmbeddings(delay=0.05)
+        batcher = _EmbeddingBatcher(SimpleNamespace(embeddings=embeddings), "model")
+        pending = asyncio.create_task(batcher.embed("text"))
+        # Ждём, пока окно сбора закроется и пачка уйдёт в OpenAI.
+        while not embeddings.calls:
+            await asyncio.sleep(0.01)
+
+        await batcher.close()
+
+        self.assertEqual(await pending, [0.0])
+
+    async def test_close_fails_unsent_requests(self) -> None:
+        embeddings = FakeEmbeddings(delay=0)
+        batcher = _EmbeddingBatcher(SimpleNamespace(embeddings=embeddings), "model")
+        pending = asyncio.create_task(batcher.embed("text"))
+        await asyncio.sleep(0)
+
+        await batcher.close()
+
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(pending, 1)
+        self.assertEqual(embeddings.calls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
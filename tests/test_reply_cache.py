@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from app.bot import TelegramCooBot
+from app.config import Settings
+
+
+def make_settings() -> Settings:
+    return Settings(
+        telegram_bot_token="token",
+        telegram_allowed_user_ids=frozenset(),
+        telegram_allowed_username=None,
+        bot_timezone="Europe/Moscow",
+        openai_api_key="sk-test",
+        openai_model="gpt-5",
+        memory_embed_model="text-embedding-3-small",
+        database_url=None,
+        redis_url=None,
+        memory_enabled=True,
+        memory_recent_turns=10,
+        memory_semantic_k=6,
+        notion_token="secret",
+        notion_parent_page_id=None,
+        notion_source_db_ids=[],
+        notion_access_phrase=None,
+        notion_workspace_page_id=None,
+        notion_tasks_db_id=None,
+        notion_projects_db_id=None,
+        notion_snapshot_ttl_sec=45.0,
+        notion_ids_cache_path=".coo_state.test.json",
+    )
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.data: dict[str, str] = {}
+
+    async def get(self, key: str) -> str | None:
+        return self.data.get(key)
+
+    async def set(self, key: str, value: str, ex: int | None = None) -> None:
+        self.data[key] = value
+
+
+def make_update(text: str) -> SimpleNamespace:
+    message = SimpleNamespace(text=text, reply_text=AsyncMock())
+    return SimpleNamespace(effective_user=SimpleNamespace(id=42, username="user"), message=message)
+
+
+class ReplyCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.bot = TelegramCooBot(make_settings())
+        self.bot.notion.get_focus_snapshot = AsyncMock(return_value="Проекты:\n- COO [Main]")
+        self.bot.notion.get_external_sources_snapshot = AsyncMock(return_value="")
+        self.bot.memory.redis = FakeRedis()
+        self.history: list[str] = []
+        self.bot.memory.get_context = AsyncMock(side_effect=lambda **_: {"recent": list(self.history), "semantic": []})
+        self.bot.memory.remember_turn = AsyncMock(side_effect=lambda **kw: self.history.append(kw["content"]))
+        self.bot.memory.remember_fact = AsyncMock()
+        self.bot.agent = SimpleNamespace(
+            reply_with_plan=AsyncMock(return_value={"reply": "Фокус на COO.", "actions": []})
+        )
+
+    async def ask(self, text: str) -> SimpleNamespace:
+        update = make_update(text)
+        await self.bot._process_user_input(update, text)
+        await asyncio.gather(*self.bot._background_tasks)
+        return update
+
+    async def test_repeated_question_hits_cache_after_history_changed(self) -> None:
+        await self.ask("Что сейчас в фокусе на этой неделе?")
+        update = await self.ask("Что сейчас в фокусе на этой неделе?")
+
+        self.assertEqual(self.bot.agent.reply_with_plan.await_count, 1)
+        update.message.reply_text.assert_awaited_once_with("Фокус на COO.")
+
+    async def test_notion_change_invalidates_cached_reply(self) -> None:
+        await self.ask("Что сейчас в фокусе на этой неделе?")
+        self.bot.notion.get_focus_snapshot.return_value = "Проекты:\n- COO [Paused]"
+        await self.ask("Что сейчас в фокусе на этой неделе?")
+
+        self.assertEqual(self.bot.agent.reply_with_plan.await_count, 2)
+
+    async def test_short_follow_up_is_not_cached(self) -> None:
+        await self.ask("подробнее")
+        await self.ask("подробнее")
+
+        self.assertEqual(self.bot.agent.reply_with_plan.await_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from app.telegram_text import TELEGRAM_MESSAGE_LIMIT, split_message
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+class SplitMessageTest(unittest.TestCase):
+    def test_short_text_is_single_chunk(self) -> None:
+        self.assertEqual(split_message("привет"), ["привет"])
+
+    def test_prefers_newline_cut(self) -> None:
+        text = "a" * 10 + "\n" + "b" * 10
+        self.assertEqual(split_message(text, limit=15), ["a" * 10 + "\n", "b" * 10])
+
+    def test_surrogate_pair_is_not_split(self) -> None:
+        chunks = split_message("a" * 9 + "😀", limit=10)
+        self.assertEqual(chunks, ["a" * 9, "😀"])
+
+    def test_chunk_never_exceeds_limit_after_newline_cut(self) -> None:
+        # Жёсткий разрез прямо перед "\n", затем часть без переводов строки и символ вне BMP.
+        text = "a" * 4096 + "\n" + "b" * 4095 + "😀" + "c" * 10
+        chunks = split_message(text)
+        self.assertTrue(all(utf16_len(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks))
+        # Части из одних пробельных символов не отправляются, остальной текст сохраняется.
+        self.assertEqual("".join(chunks).replace("\n", ""), text.replace("\n", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()